@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ Checks that reopening the plugin dialog does not multiply the work of its
+ buttons. Opens the dialog several times under an offscreen QGIS test
+ application, then clicks "Add selected fields" and counts the calls of
+ the slot and the scans of the layer it causes.
+
+     python benchmarks/bench_dialog.py [--opens 10]
+"""
+
+import argparse
+import os
+import sys
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import synthetic  # noqa: E402
+from bench_pipeline import plugin_module  # noqa: E402
+
+
+def count_calls(owner, name, counts):
+    """ replace owner.name by a wrapper counting its calls in counts """
+    function = getattr(owner, name)
+
+    def counted(*args, **kwargs):
+        counts[name] = counts.get(name, 0) + 1
+        return function(*args, **kwargs)
+
+    setattr(owner, name, counted)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--opens', type=int, default=10,
+                        help='times the dialog is opened before clicking')
+    parser.add_argument('--features', type=int, default=10000)
+    args = parser.parse_args()
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from qgis.PyQt.QtCore import QSettings
+    from qgis.core import QgsProject
+    from qgis.testing import start_app
+    from qgis.testing.mocked import get_iface
+
+    # the test application keeps its settings apart from the user's
+    start_app()
+    if not QSettings().value('locale/userLocale'):
+        QSettings().setValue('locale/userLocale', 'en_US')
+
+    plugin_class = plugin_module('suitability_analysis').SuitabilityAnalysis
+    dialog_class = plugin_module(
+        'suitability_analysis_dialog').SuitabilityAnalysisDialog
+    extraction = plugin_module('extraction')
+
+    # close every dialog at once, as if Cancel was pressed
+    dialog_class.exec_ = lambda dialog: 0
+
+    layer = synthetic.synthetic_layer(args.features, 4)
+    QgsProject.instance().addMapLayer(layer)
+
+    counts = {}
+    count_calls(extraction, 'extract_columns', counts)
+    plugin = plugin_class(get_iface())
+    plugin.first_start = True
+    count_calls(plugin, 'populateTable', counts)
+
+    for _ in range(args.opens):
+        plugin.run()
+    dlg = plugin.dlg
+    dlg.layerInput.setLayer(layer)
+
+    failures = []
+    names = plugin.criteriaNames(layer)
+    if dlg.fieldSelector.count() != len(names):
+        failures.append('field list holds {} items for {} criteria after '
+                        '{} opens'.format(dlg.fieldSelector.count(),
+                                          len(names), args.opens))
+
+    for row in range(2):
+        dlg.fieldSelector.item(row).setSelected(True)
+
+    for click, scans in [('first', 1), ('second', 0)]:
+        counts.clear()
+        dlg.addFields.click()
+        print('{} click: {} populateTable calls, {} layer scans'.format(
+            click, counts.get('populateTable', 0),
+            counts.get('extract_columns', 0)))
+        if counts.get('populateTable', 0) != 1:
+            failures.append('{} click ran populateTable {} times'.format(
+                click, counts.get('populateTable', 0)))
+        if counts.get('extract_columns', 0) != scans:
+            failures.append('{} click scanned the layer {} times, expected '
+                            '{}'.format(click,
+                                        counts.get('extract_columns', 0),
+                                        scans))
+
+    plugin.run()
+    if dlg.fieldTable.rowCount() != 2:
+        failures.append('reopening the dialog cleared the criteria table')
+
+    for failure in failures:
+        print('FAIL', failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ Checks that a GeoPackage output can be re-scored in place. Writes a
+ synthetic layer to a GeoPackage under an offscreen QGIS application,
+ changes only the weights and compares the scores read back from the
+ file with the new ones.
+
+     python benchmarks/bench_export.py [--features 10000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import synthetic  # noqa: E402
+from bench_pipeline import plugin_module  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--features', type=int, default=10000)
+    parser.add_argument('--fields', type=int, default=4)
+    args = parser.parse_args()
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from qgis.core import QgsApplication
+    app = QgsApplication([], False)
+    app.initQgis()
+
+    pipeline_module = plugin_module('pipeline')
+    layer = synthetic.synthetic_layer(args.features, args.fields)
+    criteria = synthetic.synthetic_criteria(args.fields)
+
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'output.gpkg')
+        pipeline = pipeline_module.SuitabilityPipeline(
+            layer, criteria, destination=('GeoPackage', path))
+        pipeline.run()
+
+        written = pipeline.outputIds[pipeline.result.mask]
+        if not (written >= 0).all():
+            failures.append('{} of {} written features have no output id'
+                            .format(int((written < 0).sum()), len(written)))
+
+        reweighted = {name: dict(spec) for name, spec in criteria.items()}
+        first = next(iter(reweighted))
+        reweighted[first]['weight'] += 50
+        if not pipeline.canRescore(reweighted, filters=pipeline.filterKey):
+            failures.append('a weight-only change cannot be re-scored in '
+                            'place')
+        else:
+            updated = pipeline.rescore(reweighted)
+            print('re-scored {} features in place'.format(updated))
+
+            output = plugin_module('export').open_output(path, 'GeoPackage')
+            index = output.fields().indexOf('score')
+            scores = {feat.id(): feat.attributes()[index]
+                      for feat in output.getFeatures()}
+            rows = np.flatnonzero(pipeline.result.mask)
+            expected = pipeline.result.score[rows]
+            actual = np.array([scores[fid]
+                               for fid in pipeline.outputIds[rows].tolist()],
+                              dtype=np.float64)
+            if not np.allclose(actual, expected):
+                failures.append('scores in the file differ from the '
+                                're-scored ones')
+            del output
+
+    for failure in failures:
+        print('FAIL', failure)
+    app.exitQgis()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
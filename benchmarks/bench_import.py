@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ Checks the cost the plugin adds to QGIS startup. Imports the module that
+ classFactory loads in a fresh interpreter, after qgis itself, and fails
+ if that takes longer than the budget or pulls in heavy dependencies.
+
+     python benchmarks/bench_import.py [--budget 0.1]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that must only be loaded once an analysis runs
+HEAVY = ('numpy', 'pandas')
+
+PROBE = '''
+import sys, time
+sys.path.insert(0, {parent!r})
+import qgis.core, qgis.gui, qgis.utils
+before = set(sys.modules)
+start = time.perf_counter()
+import {package}.suitability_analysis
+print(time.perf_counter() - start)
+print(' '.join(sorted(name for name in set(sys.modules) - before
+                      if name.split('.')[0] in {heavy!r})))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--budget', type=float, default=0.1,
+                        help='seconds the plugin import may take')
+    args = parser.parse_args()
+
+    probe = PROBE.format(parent=os.path.dirname(PLUGIN_DIR),
+                         package=os.path.basename(PLUGIN_DIR),
+                         heavy=HEAVY)
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    output = subprocess.run([sys.executable, '-c', probe], env=env,
+                            capture_output=True, text=True)
+    if output.returncode != 0:
+        print(output.stderr)
+        return 1
+
+    seconds, heavy = (output.stdout.splitlines() + [''])[:2]
+    seconds = float(seconds)
+    print('plugin import {:.3f} s, budget {:.3f} s'.format(seconds,
+                                                          args.budget))
+
+    failures = []
+    if seconds > args.budget:
+        failures.append('plugin import exceeds the budget')
+    if heavy:
+        failures.append('plugin import loads {}'.format(heavy))
+    for failure in failures:
+        print('FAIL', failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
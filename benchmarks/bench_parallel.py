@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ Scores synthetic columns serially and on thread and process pools, and
+ fails unless every pool reproduces the serial mask, score and rank
+ exactly. Prints the speedup of each pool.
+
+ Runs headless, without qgis:
+
+     python benchmarks/bench_parallel.py [--rows 10000000] [--workers 8]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic  # noqa: E402
+from bench_pipeline import plugin_module  # noqa: E402
+
+# value functions spread over the criteria, whole-column ones included
+METHODS = ['linear', 'sigmoid', 'piecewise(0:0, 50:1, 100:0.2)', 'zscore',
+           'percentile']
+
+
+def score(columns, criteria, aggregation, executor, chunks):
+    """ the calculations stage of the pipeline on an optional pool """
+    scoring = plugin_module('scoring')
+    parallel = plugin_module('parallel')
+
+    mask = scoring.criteria_mask(columns, criteria)
+    matrix = parallel.normalize_columns_parallel(columns, criteria, mask,
+                                                 executor=executor,
+                                                 chunks=chunks)
+    aggregate_score = parallel.aggregate_parallel(
+        matrix, scoring.criteria_weights(criteria), aggregation, executor,
+        chunks)
+    return scoring.rank_scores(mask, aggregate_score)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--fields', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    parallel = plugin_module('parallel')
+    columns = synthetic.synthetic_columns(args.rows, args.fields)
+    criteria = synthetic.synthetic_criteria(args.fields)
+    for i, spec in enumerate(criteria.values()):
+        spec['method'] = METHODS[i % len(METHODS)]
+
+    failures = []
+    for aggregation in ['weighted_sum', 'weighted_product', 'owa']:
+        start = time.perf_counter()
+        serial = score(columns, criteria, aggregation, None, None)
+        serial_seconds = time.perf_counter() - start
+
+        for processes in (False, True):
+            executor = parallel.create_executor(max(args.workers, 2),
+                                                processes)
+            kind = 'processes' if processes else 'threads'
+            if executor is None:
+                print('{:<17} {:<9} unavailable'.format(aggregation, kind))
+                continue
+            with executor:
+                start = time.perf_counter()
+                result = score(columns, criteria, aggregation, executor,
+                               args.workers)
+                seconds = time.perf_counter() - start
+
+            print('{:<17} {:<9} {:>8.3f} s serial {:>8.3f} s '
+                  '{:>5.2f}x'.format(aggregation, kind, seconds,
+                                     serial_seconds,
+                                     serial_seconds / max(seconds, 1e-9)))
+            if not all(np.array_equal(a, b, equal_nan=True)
+                       for a, b in zip(serial, result)):
+                failures.append('{} on {} differs from serial'.format(
+                    aggregation, kind))
+
+    for failure in failures:
+        print('FAIL', failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ Times each stage of the scoring pipeline on synthetic data at growing
+ feature counts, records peak traced memory and fails if a stage grows
+ worse than linearly.
+
+ Headless, against the pure-Python scoring engine only:
+
+     python benchmarks/bench_pipeline.py
+
+ Every stage, under an offscreen QGIS application:
+
+     python benchmarks/bench_pipeline.py --qgis --geometry polygon
+"""
+
+import argparse
+import gc
+import importlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+import synthetic  # noqa: E402
+
+# allowed growth over linear, to absorb cache effects and timer noise
+TOLERANCE = 2.0
+
+# stages that sort, allowed an extra log n factor
+SORTING = {'calculations', 'sensitivity'}
+
+
+def plugin_module(name):
+    """ import a module of the plugin package, relative imports included """
+    sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+    return importlib.import_module(
+        '{}.{}'.format(os.path.basename(PLUGIN_DIR), name))
+
+
+def measure(function):
+    """ wall time in seconds and peak traced memory in bytes of a call """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def engine_stages(n, m):
+    """ (stage, function) pairs for the headless engine """
+    scoring = plugin_module('scoring')
+    sensitivity = plugin_module('sensitivity')
+    columns = synthetic.synthetic_columns(n, m)
+    criteria = synthetic.synthetic_criteria(m)
+    matrix = scoring.normalize_columns(
+        columns, criteria, scoring.criteria_mask(columns, criteria))
+    samples = sensitivity.sample_weights(scoring.criteria_weights(criteria),
+                                         20)
+
+    return [
+        ('calculations', lambda: scoring.score_columns(columns, criteria)),
+        ('calculations_top100',
+         lambda: scoring.score_columns(columns, criteria, top_k=100)),
+        ('sensitivity_20samples',
+         lambda: sensitivity.rank_statistics(matrix, samples, 'weighted_sum')),
+    ]
+
+
+def qgis_stages(n, m, geometry):
+    """ (stage, function) pairs running a SuitabilityPipeline on a
+    synthetic memory layer """
+    pipeline_module = plugin_module('pipeline')
+    layer = synthetic.synthetic_layer(n, m, geometry)
+    pipeline = pipeline_module.SuitabilityPipeline(
+        layer, synthetic.synthetic_criteria(m))
+
+    return [
+        ('pandify', pipeline.pandify),
+        ('calculations', pipeline.calculations),
+        ('createOutputLayer', pipeline.createOutputLayer),
+        ('updateSHP', pipeline.updateSHP),
+    ]
+
+
+def run(sizes, m, use_qgis, geometry):
+    """ time every stage at every size
+
+    :returns: Mapping of stage to a list of (size, seconds, peak bytes).
+    :rtype: dict
+    """
+    results = {}
+    for n in sizes:
+        if use_qgis:
+            stages = qgis_stages(n, m, geometry)
+        else:
+            stages = engine_stages(n, m)
+
+        for stage, function in stages:
+            elapsed, peak = measure(function)
+            results.setdefault(stage, []).append((n, elapsed, peak))
+            print('{:<22} {:>9} features {:>9.3f} s {:>10.0f} features/s '
+                  '{:>9.1f} MB peak'.format(stage, n, elapsed,
+                                            n / max(elapsed, 1e-9),
+                                            peak / 2 ** 20))
+    return results
+
+
+def superlinear(results, sorting=SORTING):
+    """ descriptions of the stages whose time or memory grew faster than
+    the feature count
+
+    :param results: Mapping of stage to a list of (size, seconds, peak
+        bytes), see run. Peaks of 0 are not checked.
+    :type results: dict
+
+    :param sorting: Stages, or stage name prefixes before an underscore,
+        allowed an extra log n factor.
+    :type sorting: set
+    """
+    failures = []
+    for stage, runs in results.items():
+        (n0, t0, m0), (n1, t1, m1) = runs[0], runs[-1]
+        allowed = TOLERANCE * n1 / n0
+        if stage in sorting or stage.split('_')[0] in sorting:
+            allowed *= np.log(n1) / np.log(n0)
+
+        if t1 / max(t0, 1e-9) > allowed:
+            failures.append('{} time grew {:.1f}x for {:.0f}x features'
+                            .format(stage, t1 / t0, n1 / n0))
+        # tiny runs are dominated by fixed allocations, skip them
+        if m0 > 2 ** 20 and m1 / m0 > TOLERANCE * n1 / n0:
+            failures.append('{} memory grew {:.1f}x for {:.0f}x features'
+                            .format(stage, m1 / m0, n1 / n0))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--fields', type=int, default=8)
+    parser.add_argument('--qgis', action='store_true',
+                        help='run every stage under an offscreen QGIS')
+    parser.add_argument('--geometry', choices=['point', 'polygon'],
+                        default='point')
+    parser.add_argument('--json', help='also write the timings here')
+    args = parser.parse_args()
+
+    if args.qgis:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from qgis.core import QgsApplication
+        app = QgsApplication([], False)
+        app.initQgis()
+
+    results = run(sorted(args.sizes), args.fields, args.qgis, args.geometry)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({stage: [{'features': n, 'seconds': t, 'peak_bytes': p}
+                               for n, t, p in runs]
+                       for stage, runs in results.items()}, f, indent=2)
+
+    failures = superlinear(results)
+    for failure in failures:
+        print('FAIL', failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ Times every value function and aggregation of the scoring engine at
+ growing row counts and fails if any grows worse than linearly.
+
+ Runs headless, without qgis:
+
+     python benchmarks/bench_strategies.py [--sizes 1000000 10000000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_pipeline import plugin_module, superlinear  # noqa: E402
+
+# parameters used for value functions that need them
+PARAMS = {
+    'piecewise': (0.0, 0.0, 0.5, 1.0, 1.0, 0.2),
+    'sigmoid': (0.5, 10.0),
+}
+
+# kernels that sort the whole column, allowed an extra log n factor
+SORTING = {'value percentile'}
+
+
+def best_time(function, repeat):
+    """ fastest of repeat calls, in seconds """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(sizes, criteria_count, repeat):
+    """ time every kernel at every size
+
+    :returns: Mapping of "<kind> <name>" to a list of (size, seconds, 0),
+        see bench_pipeline.superlinear.
+    :rtype: dict
+    """
+    scoring = plugin_module('scoring')
+    rng = np.random.default_rng(0)
+    results = {}
+
+    kernels = [('value', name) for name in scoring.VALUE_FUNCTIONS]
+    kernels += [('aggregation', name) for name in scoring.AGGREGATIONS]
+
+    for kind, name in kernels:
+        for size in sizes:
+            if kind == 'value':
+                values = rng.random(size)
+                params = PARAMS.get(name, ())
+                def function():
+                    scoring.normalize(values, "+", None, name, params)
+            else:
+                matrix = np.asfortranarray(rng.random((size, criteria_count)))
+                weights = np.full(criteria_count, 100.0 / criteria_count)
+                def function():
+                    scoring.aggregate(matrix, weights, name)
+
+            elapsed = best_time(function, repeat)
+            results.setdefault('{} {}'.format(kind, name), []).append(
+                (size, elapsed, 0))
+            print('{:<12} {:<18} {:>10} rows {:>9.4f} s'.format(
+                kind, name, size, elapsed))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000000, 10000000])
+    parser.add_argument('--criteria', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    results = run(sorted(args.sizes), args.criteria, args.repeat)
+    failures = superlinear(results, SORTING)
+    for failure in failures:
+        print('FAIL', failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ Synthetic datasets for the benchmarks. The column and criteria builders
+ only need numpy, qgis is imported when a layer is requested.
+"""
+
+import numpy as np
+
+# features added to a synthetic layer per provider call
+CHUNK_SIZE = 10000
+
+
+def field_names(m):
+    """ names of the m synthetic numeric fields """
+    return ['c{}'.format(i) for i in range(m)]
+
+
+def synthetic_columns(n, m, null_fraction=0.0, seed=0):
+    """ m uniform 0..1 float64 columns of n rows, with an optional share
+    of NaN values standing in for NULLs """
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for name in field_names(m):
+        values = rng.random(n)
+        if null_fraction:
+            values[rng.random(n) < null_fraction] = np.nan
+        columns[name] = values
+    return columns
+
+
+def synthetic_criteria(m):
+    """ criteria over the synthetic fields, trimming the outer 5% of each
+    and alternating the effect """
+    return {name: {"lower": 0.05,
+                   "upper": 0.95,
+                   "weight": 100 // m,
+                   "effect": "+" if i % 2 == 0 else "-",
+                   "method": "linear"}
+            for i, name in enumerate(field_names(m))}
+
+
+def synthetic_layer(n, m, geometry='point', seed=0):
+    """ memory layer of n random points or square polygons in a
+    10 km square, with the synthetic fields as attributes
+
+    :param geometry: "point" or "polygon".
+    :type geometry: str
+
+    :rtype: QgsVectorLayer
+    """
+    from qgis.PyQt.QtCore import QVariant
+    from qgis.core import (QgsFeature, QgsField, QgsGeometry, QgsPointXY,
+                           QgsRectangle, QgsVectorLayer)
+
+    layer_type = {'point': 'Point', 'polygon': 'Polygon'}[geometry]
+    layer = QgsVectorLayer(layer_type + '?crs=EPSG:3857',
+                           'synthetic_{}_{}'.format(geometry, n), 'memory')
+    provider = layer.dataProvider()
+    provider.addAttributes([QgsField(name, QVariant.Double)
+                            for name in field_names(m)])
+    layer.updateFields()
+    fields = layer.fields()
+
+    rng = np.random.default_rng(seed)
+    xy = rng.random((n, 2)) * 10000
+    values = np.column_stack(list(synthetic_columns(n, m, seed=seed).values()))
+
+    for start in range(0, n, CHUNK_SIZE):
+        chunk = []
+        for (x, y), row in zip(xy[start:start + CHUNK_SIZE].tolist(),
+                               values[start:start + CHUNK_SIZE].tolist()):
+            feat = QgsFeature(fields)
+            if geometry == 'point':
+                feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+            else:
+                feat.setGeometry(QgsGeometry.fromRect(
+                    QgsRectangle(x, y, x + 20, y + 20)))
+            feat.setAttributes(row)
+            chunk.append(feat)
+        provider.addFeatures(chunk)
+
+    return layer
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ File destinations for the scored features, written in chunks while the
+ input is streamed so results are never held in memory as a whole.
+"""
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (QgsCoordinateTransformContext, QgsVectorFileWriter,
+                       QgsVectorLayer, QgsWkbTypes)
+
+# output formats besides a temporary layer, mapped to the GDAL driver,
+# the file extension and whether geometry is written
+FORMATS = {
+    'GeoPackage': ('GPKG', 'gpkg', True),
+    'FlatGeobuf': ('FlatGeobuf', 'fgb', True),
+    'GeoParquet': ('Parquet', 'parquet', True),
+    'Parquet (attributes only)': ('Parquet', 'parquet', False),
+}
+
+# formats GDAL can reopen for update, filled through the data provider
+UPDATABLE = {'GeoPackage'}
+
+
+def create_file(path, file_format, fields, wkb_type, crs):
+    """ create an output file and return a writer for its features
+
+    :param file_format: Key of FORMATS.
+    :type file_format: str
+
+    :rtype: QgsVectorFileWriter
+
+    :raises IOError: If GDAL cannot create the file.
+    """
+    driver, _, geometry = FORMATS[file_format]
+    if not geometry:
+        wkb_type = QgsWkbTypes.NoGeometry
+
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = driver
+    options.fileEncoding = 'UTF-8'
+    options.layerName = 'suitability_output'
+    writer = QgsVectorFileWriter.create(path, fields, wkb_type, crs,
+                                        QgsCoordinateTransformContext(),
+                                        options)
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        raise IOError(writer.errorMessage())
+    return writer
+
+
+def open_output(path, file_format):
+    """ the written file as a layer, or None if QGIS cannot read it """
+    if file_format == 'GeoPackage':
+        path += '|layername=suitability_output'
+    layer = QgsVectorLayer(path, 'suitability_output', 'ogr')
+    if not layer.isValid():
+        return None
+    return layer
+
+
+def arrow_available():
+    """ whether pyarrow can be imported """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ParquetSink:
+    """ feature sink writing attributes to a Parquet file with pyarrow
+
+    Each chunk handed to addFeatures becomes one row group, so only one
+    chunk is held in memory. Used for attribute-only Parquet output, which
+    does not need a GDAL build with the Parquet driver.
+    """
+
+    # pyarrow type names of QVariant field types, others become strings
+    TYPES = {
+        QVariant.Double: 'float64',
+        QVariant.Int: 'int64',
+        QVariant.UInt: 'int64',
+        QVariant.LongLong: 'int64',
+        QVariant.ULongLong: 'uint64',
+        QVariant.Bool: 'bool_',
+    }
+
+    def __init__(self, path, fields):
+        """Constructor.
+
+        :param path: File to create.
+        :type path: str
+
+        :param fields: Fields of the features to write.
+        :type fields: QgsFields
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema([
+            (field.name(), getattr(pa, self.TYPES.get(field.type(),
+                                                      'string'))())
+            for field in fields])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+
+    def addFeatures(self, features, flags=None):
+        """ write one chunk of features as a row group """
+        rows = [feat.attributes() for feat in features]
+        arrays = []
+        for i, field in enumerate(self.schema):
+            values = [_python_value(row[i]) for row in rows]
+            if field.type == self.pa.string():
+                values = [None if value is None else str(value)
+                          for value in values]
+            arrays.append(self.pa.array(values, type=field.type))
+        self.writer.write_table(self.pa.Table.from_arrays(
+            arrays, schema=self.schema))
+        return True
+
+
+    def close(self):
+        """ write the file footer """
+        self.writer.close()
+
+
+def _python_value(value):
+    """ None for NULL attribute values, otherwise the value """
+    if isinstance(value, QVariant):
+        return None
+    return value
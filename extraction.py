@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ Columnar extraction of attribute values from a feature source into
+ preallocated NumPy arrays.
+"""
+
+from concurrent.futures import as_completed
+
+import numpy as np
+
+from qgis.PyQt.QtCore import Qt
+from qgis.core import QgsFeatureRequest, QgsFeedback
+
+
+# features read between two cancellation checks
+FEEDBACK_INTERVAL = 10000
+
+
+def extract_columns(source, field_names, request=None, fields=None,
+                    count=None, feedback=None):
+    """ read numeric fields from a feature source into float64 arrays
+
+    Only the requested attributes are fetched and geometry is never
+    decoded. NULL values become NaN.
+
+    :param source: Layer or other feature source to read from.
+    :type source: QgsFeatureSource
+
+    :param field_names: Names of the numeric fields to extract.
+    :type field_names: list
+
+    :param request: Optional request to refine, e.g. with a filter. Its
+        flags and attribute subset are overridden.
+    :type request: QgsFeatureRequest
+
+    :param fields: Fields of the source, for sources such as
+        QgsVectorLayerFeatureSource that do not expose them.
+    :type fields: QgsFields
+
+    :param count: Expected number of features, used to size the arrays.
+    :type count: int
+
+    :param feedback: Receives progress and is polled for cancellation.
+        A cancelled extraction returns the rows read so far.
+    :type feedback: QgsFeedback
+
+    :returns: Feature ids as an int64 array and a mapping of field name to
+        a float64 array, both in iteration order.
+    :rtype: (numpy.ndarray, dict)
+    """
+    if fields is None:
+        fields = source.fields()
+    if count is None:
+        count = source.featureCount()
+    indices = [fields.lookupField(name) for name in field_names]
+
+    if request is None:
+        request = QgsFeatureRequest()
+    request.setFlags(request.flags() | QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes(indices)
+
+    # featureCount may be an estimate, arrays grow if it was too low
+    capacity = max(count, 0)
+    total = max(capacity, 1)
+    ids = np.empty(capacity, dtype=np.int64)
+    arrays = [np.empty(capacity, dtype=np.float64) for _ in indices]
+
+    row = 0
+    for feat in source.getFeatures(request):
+        if row == capacity:
+            capacity = max(2 * capacity, 1024)
+            ids = _grow(ids, capacity)
+            arrays = [_grow(array, capacity) for array in arrays]
+
+        ids[row] = feat.id()
+        attrs = feat.attributes()
+        for array, index in zip(arrays, indices):
+            try:
+                array[row] = attrs[index]
+            except TypeError:
+                # NULL attribute values
+                array[row] = np.nan
+        row += 1
+
+        if feedback is not None and row % FEEDBACK_INTERVAL == 0:
+            if feedback.isCanceled():
+                break
+            feedback.setProgress(min(100 * row / total, 100))
+
+    columns = {name: array[:row] for name, array in zip(field_names, arrays)}
+    return ids[:row], columns
+
+
+def feature_ids(source, request=None, count=None, feedback=None):
+    """ ids of every feature in iteration order, without attributes or
+    geometry
+
+    :param request: Optional request to refine, see extract_columns.
+    :type request: QgsFeatureRequest
+
+    :rtype: numpy.ndarray
+    """
+    if request is None:
+        request = QgsFeatureRequest()
+    request.setFlags(request.flags() | QgsFeatureRequest.NoGeometry)
+    request.setNoAttributes()
+    if count is None:
+        count = source.featureCount()
+
+    ids = np.empty(max(count, 0), dtype=np.int64)
+    row = 0
+    for feat in source.getFeatures(request):
+        if row == len(ids):
+            ids = _grow(ids, max(2 * len(ids), 1024))
+        ids[row] = feat.id()
+        row += 1
+
+        if feedback is not None and row % FEEDBACK_INTERVAL == 0:
+            if feedback.isCanceled():
+                break
+    return ids[:row]
+
+
+def feature_batches(source, request, ids, rows=None, filter_ids=False):
+    """ features of ids paired with their rows, in batches of
+    FEEDBACK_INTERVAL features
+
+    Rows are found by a binary search over a sorted copy of ids, so no
+    Python object is kept per id. Features of other ids are skipped.
+
+    :param request: Request to read the features with, not modified.
+    :type request: QgsFeatureRequest
+
+    :param ids: Feature ids to read.
+    :type ids: numpy.ndarray
+
+    :param rows: Row of every id, their positions in ids when omitted.
+    :type rows: numpy.ndarray
+
+    :param filter_ids: Ask the source for ids only, one request per
+        batch, instead of reading every feature of request.
+    :type filter_ids: bool
+
+    :returns: Generator of (features, rows) pairs, a list of features and
+        an int64 array of their rows.
+    """
+    if len(ids) == 0:
+        return
+    if rows is None:
+        rows = np.arange(len(ids))
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    sorted_rows = rows[order]
+
+    def matched(features):
+        read = np.fromiter((feat.id() for feat in features), dtype=np.int64,
+                           count=len(features))
+        positions = np.minimum(np.searchsorted(sorted_ids, read),
+                               len(sorted_ids) - 1)
+        found = sorted_ids[positions] == read
+        return ([feat for feat, keep in zip(features, found.tolist())
+                 if keep], sorted_rows[positions[found]])
+
+    def requests():
+        if not filter_ids:
+            yield request
+            return
+        # one id set of a batch at a time
+        for start in range(0, len(sorted_ids), FEEDBACK_INTERVAL):
+            part = QgsFeatureRequest(request)
+            part.setFilterFids(
+                sorted_ids[start:start + FEEDBACK_INTERVAL].tolist())
+            yield part
+
+    batch = []
+    for part in requests():
+        for feat in source.getFeatures(part):
+            batch.append(feat)
+            if len(batch) == FEEDBACK_INTERVAL:
+                yield matched(batch)
+                batch = []
+    if batch:
+        yield matched(batch)
+
+
+def extract_columns_parallel(sources, field_names, executor, request=None,
+                             fields=None, count=None, feedback=None):
+    """ extract_columns split over feature id ranges read concurrently
+
+    The ids passing request are listed first, then every range is read
+    with its own feature source on a thread of executor. Rows are put back into the
+    order of the first source, so the result equals extract_columns.
+
+    :param sources: One independent feature source per range, e.g.
+        QgsVectorLayerFeatureSource snapshots of the same layer taken on
+        the main thread.
+    :type sources: list
+
+    :param executor: Thread pool, feature sources cannot be sent to
+        other processes.
+    :type executor: concurrent.futures.ThreadPoolExecutor
+
+    :rtype: (numpy.ndarray, dict)
+    """
+    ids = feature_ids(sources[0], request, count, feedback)
+    if feedback is not None and feedback.isCanceled():
+        return ids[:0], {name: np.empty(0) for name in field_names}
+
+    arguments = []
+    for source, part in zip(sources, np.array_split(ids, len(sources))):
+        request = QgsFeatureRequest()
+        request.setFilterFids(part.tolist())
+        arguments.append((source, field_names, request, fields, len(part)))
+    parts = map_ranges(executor, extract_columns, arguments, feedback)
+    if feedback is not None and feedback.isCanceled():
+        return ids[:0], {name: np.empty(0) for name in field_names}
+
+    # fid filters may return a range in any order
+    read_ids = np.concatenate([part[0] for part in parts])
+    sorter = np.argsort(read_ids)
+    order = sorter[np.searchsorted(read_ids, ids, sorter=sorter)]
+    columns = {name: np.concatenate([part[1][name] for part in parts])[order]
+               for name in field_names}
+    return ids, columns
+
+
+def map_ranges(executor, function, arguments, feedback=None):
+    """ call function once per argument tuple on executor, each call
+    with a child feedback as its last argument
+
+    Cancelling feedback cancels every child, and its progress counts the
+    completed calls.
+
+    :param arguments: Argument tuple of every call.
+    :type arguments: list
+
+    :returns: Results of the calls in the order of arguments.
+    :rtype: list
+    """
+    futures = []
+    for args in arguments:
+        child = QgsFeedback()
+        if feedback is not None:
+            # cancel() is thread safe, deliver it without an event loop
+            feedback.canceled.connect(child.cancel, Qt.DirectConnection)
+        futures.append(executor.submit(function, *args, child))
+
+    done = 0
+    for _ in as_completed(futures):
+        done += 1
+        if feedback is not None:
+            feedback.setProgress(100 * done / len(futures))
+
+    return [future.result() for future in futures]
+
+
+def _grow(array, capacity):
+    """ copy array into a larger uninitialised array """
+    grown = np.empty(capacity, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+"""
+
+from functools import partial
+
+
+class FieldStatisticsCache:
+    """ min/max of numeric fields, kept across runs of the plugin
+
+    Entries are keyed by layer id, field name and the layer's data
+    generation. The generation is bumped whenever the layer reports
+    changed data or a new data source, which drops its cached entries.
+
+    Created at plugin startup, so numpy and the extraction module are only
+    imported once statistics are actually computed.
+    """
+
+    def __init__(self):
+        """Constructor."""
+        self._stats = {}
+        self._generations = {}
+
+
+    def generation(self, layer):
+        """ current data generation of a layer, watching it on first use """
+        layer_id = layer.id()
+        if layer_id not in self._generations:
+            self._generations[layer_id] = 0
+            layer.dataChanged.connect(partial(self.invalidate, layer_id))
+            layer.dataSourceChanged.connect(partial(self.invalidate, layer_id))
+            layer.willBeDeleted.connect(partial(self.forget, layer_id))
+        return self._generations[layer_id]
+
+
+    def invalidate(self, layer_id):
+        """ drop cached entries after the layer's data changed """
+        self._generations[layer_id] = self._generations.get(layer_id, 0) + 1
+        self._stats = {key: value for key, value in self._stats.items()
+                       if key[0] != layer_id}
+
+
+    def forget(self, layer_id):
+        """ drop everything known about a removed layer """
+        self.invalidate(layer_id)
+        del self._generations[layer_id]
+
+
+    def lookup(self, layer, field_names):
+        """ cached (min, max) of the given fields, without scanning
+
+        :returns: Mapping of field name to (min, max) for the fields that
+            are cached, missing fields are left out.
+        :rtype: dict
+        """
+        generation = self.generation(layer)
+        layer_id = layer.id()
+        return {name: self._stats[(layer_id, name, generation)]
+                for name in field_names
+                if (layer_id, name, generation) in self._stats}
+
+
+    def statistics(self, layer, field_names):
+        """ (min, max) of the given fields, scanning the layer once for
+        all fields that are not cached yet
+
+        :returns: Mapping of field name to (min, max). Both are None for
+            a field without any non-NULL values.
+        :rtype: dict
+        """
+        generation = self.generation(layer)
+        stats = self.lookup(layer, field_names)
+
+        missing = [name for name in field_names if name not in stats]
+        if missing:
+            from .extraction import extract_columns
+
+            _, columns = extract_columns(layer, missing)
+            self.store(layer.id(), generation, columns)
+            stats.update(self.lookup(layer, missing))
+
+        return stats
+
+
+    def restore(self, layer, stats):
+        """ cache (min, max) pairs known from elsewhere, e.g. a criteria
+        profile saved for the same layer data
+
+        :param stats: Mapping of field name to (min, max).
+        :type stats: dict
+        """
+        generation = self.generation(layer)
+        for name, (min_value, max_value) in stats.items():
+            self._stats[(layer.id(), name, generation)] = (min_value,
+                                                           max_value)
+
+
+    def store(self, layer_id, generation, columns):
+        """ cache the min/max of columns holding every feature of a layer
+
+        Columns extracted at an older generation are ignored, so a layer
+        edited while an analysis was running does not get stale entries.
+
+        :param columns: Mapping of field name to a float64 array.
+        :type columns: dict
+        """
+        if self._generations.get(layer_id) != generation:
+            return
+
+        for name, values in columns.items():
+            self._stats[(layer_id, name, generation)] = _min_max(values)
+
+
+def _min_max(values):
+    """ (min, max) of the non-NaN values, or (None, None) """
+    import numpy as np
+
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return (None, None)
+    return (float(values.min()), float(values.max()))
+
+
+class SpatialCriteriaCache:
+    """ values of spatial criteria, kept across runs of the plugin
+
+    Entries are keyed by the analysed layer, the second layer, both their
+    data generations as tracked by a FieldStatisticsCache, and the kind of
+    criterion, see spatial.parse_spatial. Each holds the sorted ids of the
+    features computed so far and their values. Entries are dropped when
+    either of their layers is removed.
+    """
+
+    def __init__(self, generations):
+        """Constructor.
+
+        :param generations: Tracks the data generations of the layers.
+        :type generations: FieldStatisticsCache
+        """
+        self.generations = generations
+        self._values = {}
+        self._watched = set()
+
+
+    def watch(self, layer):
+        """ forget the entries of a layer once it is removed """
+        layer_id = layer.id()
+        if layer_id not in self._watched:
+            self._watched.add(layer_id)
+            layer.willBeDeleted.connect(partial(self.forget, layer_id))
+
+
+    def forget(self, layer_id):
+        """ drop the entries of a removed layer, analysed or second """
+        self._watched.discard(layer_id)
+        self._values = {key: entry for key, entry in self._values.items()
+                        if layer_id not in (key[0], key[2])}
+
+
+    def key(self, layer, other, kind):
+        """ key of the values of kind for layer against other """
+        self.watch(layer)
+        self.watch(other)
+        return (layer.id(), self.generations.generation(layer),
+                other.id(), self.generations.generation(other), kind)
+
+
+    def isCurrent(self, key):
+        """ whether neither layer of key changed since it was made """
+        from qgis.core import QgsProject
+
+        layer_id, generation, other_id, other_generation, _ = key
+        project = QgsProject.instance()
+        layer = project.mapLayer(layer_id)
+        other = project.mapLayer(other_id)
+        return (layer is not None and other is not None
+                and self.generations.generation(layer) == generation
+                and self.generations.generation(other) == other_generation)
+
+
+    def lookup(self, key):
+        """ (sorted ids, values) cached for key, or None """
+        return self._values.get(key)
+
+
+    def store(self, key, ids, values):
+        """ cache the values of the features ids, replacing entries of
+        older generations and entries holding fewer features
+
+        :param ids: Feature ids in any order.
+        :type ids: numpy.ndarray
+
+        :param values: Values in the order of ids.
+        :type values: numpy.ndarray
+        """
+        import numpy as np
+
+        existing = self._values.get(key)
+        if existing is not None and len(existing[0]) >= len(ids):
+            return
+
+        pair = (key[0], key[2], key[4])
+        self._values = {other: entry for other, entry in self._values.items()
+                        if (other[0], other[2], other[4]) != pair}
+        order = np.argsort(ids)
+        self._values[key] = (ids[order], values[order])
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ Translation of the criteria bounds and an area of interest into a
+ QgsFeatureRequest, so providers with attribute and spatial indexes only
+ return candidate features.
+"""
+
+import math
+
+from qgis.core import QgsExpression, QgsFeatureRequest, QgsRectangle
+
+# providers that evaluate a filter expression slower than the NumPy mask
+# applied after extraction
+CLIENT_SIDE_PROVIDERS = {'memory'}
+
+
+def bounds_expression(criteria, stats=None):
+    """ filter expression keeping features within every criterion's bounds
+
+    Bounds that include the whole known range of a field filter nothing
+    and are left out, as are infinite bounds. Criteria that impute NULL
+    values must not be pushed down, see scoring.fill_missing.
+
+    :param criteria: Criteria spec as built by fetchCriteria.
+    :type criteria: dict
+
+    :param stats: Known (min, max) of the criteria fields.
+    :type stats: dict
+
+    :returns: Expression, or None if no bound narrows the features.
+    :rtype: str
+    """
+    if stats is None:
+        stats = {}
+
+    terms = []
+    for field, spec in criteria.items():
+        min_value, max_value = stats.get(field, (None, None))
+        if (min_value is not None and spec['lower'] <= min_value
+                and spec['upper'] >= max_value):
+            continue
+        column = QgsExpression.quotedColumnRef(field)
+        comparisons = ['{} {} {}'.format(column, operator,
+                                         QgsExpression.quotedValue(bound))
+                       for operator, bound in (('>=', spec['lower']),
+                                               ('<=', spec['upper']))
+                       if not math.isinf(bound)]
+        if not comparisons:
+            # NULL values are still dropped by the mask after extraction
+            continue
+        terms.append(' AND '.join(comparisons))
+
+    if not terms:
+        return None
+    return ' AND '.join('({})'.format(term) for term in terms)
+
+
+def candidate_request(criteria, stats=None, extent=None, aoi=None,
+                      bounds=True):
+    """ feature request returning only features that can pass the bounds
+    and lie in the area of interest
+
+    :param extent: Rectangle in the source CRS.
+    :type extent: QgsRectangle
+
+    :param aoi: Polygon in the source CRS. Its bounding box is used as a
+        filter rectangle and the exact test as part of the expression.
+    :type aoi: QgsGeometry
+
+    :param bounds: Push the criteria bounds down as an expression, see
+        CLIENT_SIDE_PROVIDERS.
+    :type bounds: bool
+
+    :returns: Request, or None if nothing is filtered. It matches no
+        feature when extent and aoi do not overlap.
+    :rtype: QgsFeatureRequest
+    """
+    expressions = []
+    if bounds:
+        expressions.append(bounds_expression(criteria, stats))
+
+    rect = None
+    if extent is not None and not extent.isNull():
+        rect = QgsRectangle(extent)
+    if aoi is not None and not aoi.isEmpty():
+        box = aoi.boundingBox()
+        if rect is not None and not rect.intersects(box):
+            # a null rectangle would filter nothing, match no feature
+            request = QgsFeatureRequest()
+            request.setFilterFids([])
+            return request
+        rect = box if rect is None else rect.intersect(box)
+        expressions.append('intersects($geometry, geom_from_wkt({}))'.format(
+            QgsExpression.quotedValue(aoi.asWkt())))
+
+    expressions = [expression for expression in expressions if expression]
+    if rect is None and not expressions:
+        return None
+
+    request = QgsFeatureRequest()
+    if rect is not None:
+        request.setFilterRect(rect)
+    if expressions:
+        request.setFilterExpression(' AND '.join(
+            '({})'.format(expression) for expression in expressions))
+    return request
+
+
+def filter_key(layer, selected_only=False, extent=None, aoi=None):
+    """ everything that decides which features of layer an analysis
+    considers, apart from the criteria bounds
+
+    Two runs with equal keys and bounds score the same features.
+
+    :returns: Hashable key, None when every feature is considered.
+    :rtype: tuple
+    """
+    if not selected_only and extent is None and aoi is None:
+        return None
+    selection = None
+    if selected_only:
+        selection = frozenset(layer.selectedFeatureIds())
+    return (selection,
+            None if extent is None else extent.toString(),
+            None if aoi is None else aoi.asWkt())
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ Chunked scoring over a pool of workers. Plain NumPy like scoring.py, the
+ results are identical to the serial normalize_columns and aggregate.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from .scoring import (ELEMENTWISE, aggregate, normalization_key,
+                      normalize, normalize_columns, parse_method)
+
+# rows below which a pool costs more than it saves
+PARALLEL_ROWS = 200000
+
+
+def create_executor(workers, processes=False):
+    """ a pool of workers, or None when the work should run serially
+
+    :param workers: Number of workers, 1 or less runs serially.
+    :type workers: int
+
+    :param processes: Use processes instead of threads. Inside QGIS only
+        threads work, a child process would start another QGIS. NumPy
+        releases the GIL in the kernels used, so threads scale as well.
+    :type processes: bool
+
+    :rtype: concurrent.futures.Executor
+    """
+    if workers is None or workers <= 1:
+        return None
+    try:
+        if processes:
+            return ProcessPoolExecutor(workers)
+        return ThreadPoolExecutor(workers)
+    except (ImportError, NotImplementedError, OSError):
+        # e.g. platforms without working semaphores
+        return None
+
+
+def row_slices(n, chunks):
+    """ split range(n) into at most chunks contiguous slices """
+    bounds = np.linspace(0, n, max(min(chunks, n), 1) + 1).astype(np.int64)
+    return [slice(int(start), int(end))
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def normalize_columns_parallel(columns, criteria, mask, stats=None,
+                               cache=None, executor=None, chunks=None):
+    """ normalize_columns with the work spread over an executor
+
+    Elementwise value functions are applied to row chunks, after their
+    (min, max) has been reduced over the chunks. Other value functions
+    need the whole column and run as one job per criterion. Chunks are
+    merged in row order, so the matrix equals the serial one.
+
+    :param executor: Pool to run the chunks on, see create_executor.
+        Runs normalize_columns when None.
+    :type executor: concurrent.futures.Executor
+
+    :param chunks: Number of row chunks, by default one per CPU.
+    :type chunks: int
+    """
+    if executor is None:
+        return normalize_columns(columns, criteria, mask, stats, cache)
+
+    if stats is None:
+        stats = {}
+    slices = row_slices(len(mask), chunks or os.cpu_count() or 1)
+
+    jobs = []
+    normalized = {}
+    for field, spec in criteria.items():
+        key = normalization_key(field, criteria)
+        column = None if cache is None else cache.get(key)
+        if column is not None:
+            jobs.append((key, column))
+            continue
+
+        values = np.asarray(columns[field], dtype=np.float64)
+        method, params = parse_method(spec.get('method'))
+        if method in ELEMENTWISE:
+            bounds = stats.get(field)
+            if bounds is None:
+                bounds = _reduce_bounds(executor, values, mask, slices)
+            futures = [executor.submit(_normalize_chunk, values[rows],
+                                       mask[rows], spec['effect'], bounds,
+                                       method, params)
+                       for rows in slices]
+        else:
+            futures = [executor.submit(_normalize_chunk, values, mask,
+                                       spec['effect'], stats.get(field),
+                                       method, params)]
+        jobs.append((key, futures))
+
+    matrix = np.empty((int(mask.sum()), len(criteria)), order='F')
+    for i, (key, job) in enumerate(jobs):
+        if isinstance(job, list):
+            job = np.concatenate([future.result() for future in job])
+        normalized[key] = matrix[:, i] = job
+
+    if cache is not None:
+        cache.clear()
+        cache.update(normalized)
+    return matrix
+
+
+def aggregate_parallel(matrix, weights, aggregation='weighted_sum',
+                       executor=None, chunks=None):
+    """ aggregate over row chunks of the matrix, see
+    normalize_columns_parallel """
+    if executor is None:
+        return aggregate(matrix, weights, aggregation)
+
+    slices = row_slices(len(matrix), chunks or os.cpu_count() or 1)
+    futures = [executor.submit(aggregate, matrix[rows], weights, aggregation)
+               for rows in slices]
+    if not futures:
+        return aggregate(matrix, weights, aggregation)
+    return np.concatenate([future.result() for future in futures])
+
+
+def _normalize_chunk(values, mask, effect, bounds, method, params):
+    """ normalize the masked rows of one chunk """
+    return normalize(values[mask], effect, bounds, method, params)
+
+
+def _chunk_bounds(values, mask):
+    """ (min, max) of the masked rows of one chunk, None if there are none """
+    values = values[mask]
+    if len(values) == 0:
+        return None
+    return values.min(), values.max()
+
+
+def _reduce_bounds(executor, values, mask, slices):
+    """ (min, max) of the masked rows over all chunks
+
+    min and max are exact, so the reduction matches a scan of the whole
+    column regardless of how it is chunked.
+    """
+    futures = [executor.submit(_chunk_bounds, values[rows], mask[rows])
+               for rows in slices]
+    bounds = [future.result() for future in futures]
+    bounds = [pair for pair in bounds if pair is not None]
+    if not bounds:
+        return None
+    return (min(pair[0] for pair in bounds), max(pair[1] for pair in bounds))
@@ -0,0 +1,937 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ The analysis pipeline, independent of the dialog so it can run inside a
+ background task.
+"""
+
+import os
+import re
+from contextlib import nullcontext
+
+import numpy as np
+
+from qgis.PyQt.QtCore import QSettings, Qt, QVariant
+from qgis.core import (QgsFeature, QgsFeatureRequest, QgsFeatureSink,
+                       QgsFeedback, QgsField, QgsFields,
+                       QgsVectorDataProvider, QgsVectorLayer,
+                       QgsVectorLayerFeatureSource,
+                       QgsVectorLayerJoinInfo,
+                       QgsVectorLayerSelectedFeatureSource, QgsWkbTypes)
+
+from .export import (FORMATS, UPDATABLE, ParquetSink, arrow_available,
+                     create_file, open_output)
+from .extraction import (extract_columns, extract_columns_parallel,
+                         feature_batches)
+from .filters import CLIENT_SIDE_PROVIDERS, candidate_request, filter_key
+from .parallel import PARALLEL_ROWS, create_executor
+from .sensitivity import rank_statistics, sample_weights
+from .spatial import spatial_columns
+from .scoring import (STATUS, ScoreResult, criteria_weights, row_status,
+                      score_columns)
+
+# number of features handed to an output sink at once
+CHUNK_SIZE = 10000
+
+
+class SuitabilityPipeline:
+    """ extract, score and write one suitability analysis
+
+    Everything the stages need from the input is captured in the
+    constructor, which must be called on the main thread. Layers are read
+    through a QgsVectorLayerFeatureSource, so the stages themselves are
+    safe to run on a worker thread.
+    """
+
+    def __init__(self, source, criteria, stats=None,
+                 aggregation='weighted_sum', top_k=None, join=False,
+                 profiler=None, workers=1, selected_only=False,
+                 extent=None, aoi=None, destination=None,
+                 flag_excluded=False, samples=0, spread=0.2,
+                 sample_top_k=10, spatial=None):
+        """Constructor.
+
+        :param source: Layer or processing feature source to analyse.
+        :type source: QgsFeatureSource
+
+        :param criteria: Criteria spec as built by fetchCriteria.
+        :type criteria: dict
+
+        :param stats: Cached (min, max) of criteria fields over the whole
+            source, see FieldStatisticsCache.lookup.
+        :type stats: dict
+
+        :param aggregation: Name of a scoring.AGGREGATIONS entry.
+        :type aggregation: str
+
+        :param top_k: Only score, rank and write the k best features.
+        :type top_k: int
+
+        :param join: Write only key, score and rank to a geometry-less
+            table for joining onto the source, see join_key_index.
+        :type join: bool
+
+        :param profiler: Records timing and memory of every stage.
+        :type profiler: StageProfiler
+
+        :param workers: Threads to extract and score large sources with,
+            see configured_workers. Extraction is only split for layers,
+            which can be read through several feature sources.
+        :type workers: int
+
+        :param selected_only: Only analyse the selected features of a
+            layer. Processing sources handle this themselves.
+        :type selected_only: bool
+
+        :param extent: Only analyse features intersecting this rectangle,
+            in the source CRS.
+        :type extent: QgsRectangle
+
+        :param aoi: Only analyse features intersecting this polygon, in
+            the source CRS.
+        :type aoi: QgsGeometry
+
+        :param destination: Write to a file instead of a memory layer,
+            as a (format, path) pair with a format of export.FORMATS.
+            Takes precedence over join.
+        :type destination: tuple
+
+        :param flag_excluded: Keep features that were not scored in the
+            output, with a NULL score and rank, and add a status field
+            telling why, see scoring.STATUS.
+        :type flag_excluded: bool
+
+        :param samples: Number of weight vectors sampled around the
+            criteria weights for a sensitivity analysis, 0 for none. Adds
+            the mean_rank, rank_std and pct_top_k result fields.
+        :type samples: int
+
+        :param spread: Relative spread of the sampled weights.
+        :type spread: float
+
+        :param sample_top_k: K of the pct_top_k result field.
+        :type sample_top_k: int
+
+        :param spatial: Spatial criteria of criteria, computed from the
+            geometries instead of extracted, see spatial.spatial_criteria.
+        :type spatial: dict
+        """
+        layer = source if isinstance(source, QgsVectorLayer) else None
+        self.selectedOnly = selected_only and layer is not None
+        if layer is not None:
+            self.source = self.layerSource(layer)
+            self.joinKeyIndex = join_key_index(layer)
+            self.featureCount = (layer.selectedFeatureCount()
+                                 if self.selectedOnly
+                                 else layer.featureCount())
+        else:
+            self.source = source
+            self.joinKeyIndex = None
+            self.featureCount = source.featureCount()
+        self.spatial = spatial or {}
+        self.workers = max(workers, 1)
+        self.rangeSources = [self.source]
+        if (layer is not None and self.workers > 1
+                and self.featureCount >= PARALLEL_ROWS):
+            self.rangeSources += [self.layerSource(layer)
+                                  for _ in range(self.workers - 1)]
+
+        # let the provider drop features outside the bounds and the area
+        # of interest, its indexes make that cheaper than the NumPy mask.
+        # Flagged features must be extracted to get a status, and imputed
+        # values are computed from every extracted row, so neither may
+        # depend on the provider
+        pushdown = ((layer is None
+                     or layer.providerType() not in CLIENT_SIDE_PROVIDERS)
+                    and not flag_excluded
+                    and all(spec.get('missing', 'exclude') == 'exclude'
+                            for spec in criteria.values()))
+        attributes = {name: spec for name, spec in criteria.items()
+                      if name not in self.spatial}
+        self.request = candidate_request(attributes, stats, extent, aoi,
+                                         pushdown)
+        self.filterKey = filter_key(source, self.selectedOnly, extent, aoi)
+        self.filtered = self.request is not None or self.selectedOnly
+        if self.filtered:
+            # cached statistics describe every feature of the source
+            stats = None
+
+        self.fields = source.fields()
+        self.wkbType = source.wkbType()
+        self.crs = source.sourceCrs()
+        self.criteria = criteria
+        self.stats = stats
+        self.aggregation = aggregation
+        self.top_k = top_k
+        self.destination = destination
+        self.join = (join and destination is None
+                     and self.joinKeyIndex is not None)
+        self.profiler = profiler
+        self.flagExcluded = flag_excluded
+        self.samples = samples
+        self.spread = spread
+        self.sampleTopK = sample_top_k
+
+        self.ids = None
+        self.columns = None
+        self.normalized = {}
+        self.result = None
+        self.status = None
+        self.sensitivity = None
+        self.outputLayer = None
+        self.outputIds = None
+
+
+    def run(self, feedback=None, sink=None):
+        """ run every stage, returns False if cancelled
+
+        :param feedback: Receives progress over all stages and is polled
+            for cancellation.
+        :type feedback: QgsFeedback
+
+        :param sink: Destination with the fields of outputFields. A new
+            memory layer is created in outputLayer when omitted.
+        :type sink: QgsFeatureSink
+        """
+        if feedback is None:
+            feedback = QgsFeedback()
+
+        step = _StepFeedback(feedback, 0, 30 if self.spatial else 40)
+        with self.profile('pandify', self.featureCount):
+            self.pandify(step)
+        if feedback.isCanceled():
+            return False
+
+        if self.spatial:
+            with self.profile('spatialCriteria', len(self.ids)):
+                self.spatialCriteria(_StepFeedback(feedback, 30, 40))
+            if feedback.isCanceled():
+                return False
+
+        with self.profile('calculations', len(self.ids)):
+            self.calculations(_StepFeedback(feedback, 40, 50))
+        if feedback.isCanceled():
+            return False
+        feedback.setProgress(50)
+
+        step = _StepFeedback(feedback, 50, 100)
+        written = (len(self.ids) if self.flagExcluded
+                   else int(self.result.mask.sum()))
+        if sink is None and self.destination is not None:
+            with self.profile('writeFile', written):
+                self.writeFile(step)
+        elif sink is None and self.join:
+            with self.profile('createResultTable', written):
+                self.createResultTable(step)
+        elif sink is None:
+            with self.profile('createOutputLayer', written):
+                self.createOutputLayer(step)
+        else:
+            with self.profile('writeFeatures', written):
+                self.writeFeatures(sink, self.outputFields(), step)
+        return not feedback.isCanceled()
+
+
+    def layerSource(self, layer):
+        """ thread safe snapshot of the features of layer to analyse """
+        if self.selectedOnly:
+            return QgsVectorLayerSelectedFeatureSource(layer)
+        return QgsVectorLayerFeatureSource(layer)
+
+
+    def profile(self, name, features=None):
+        """ context measuring one stage if a profiler is attached """
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.stage(name, features)
+
+
+    def pool(self, rows):
+        """ thread pool for a stage over rows, or a null context when
+        the stage should run serially """
+        if self.workers == 1 or rows < PARALLEL_ROWS:
+            return nullcontext()
+        return create_executor(self.workers) or nullcontext()
+
+
+    def outputFields(self):
+        """ input fields followed by the result fields
+
+        :raises ValueError: If a result field cannot be added.
+        """
+        fields = QgsFields(self.fields)
+        for field in self.resultFields():
+            if not fields.append(field):
+                raise ValueError('Cannot add the result field "{}" to the '
+                                 'input fields'.format(field.name()))
+        return fields
+
+
+    def resultFields(self):
+        """ score and rank, followed by status if excluded features are
+        flagged instead of left out
+
+        Names already used by an input field are numbered, see
+        unique_fields.
+        """
+        fields = [QgsField('score', QVariant.Double),
+                  QgsField('rank', QVariant.Double)]
+        if self.flagExcluded:
+            fields.append(QgsField('status', QVariant.String))
+        if self.samples:
+            fields += [QgsField('mean_rank', QVariant.Double),
+                       QgsField('rank_std', QVariant.Double),
+                       QgsField('pct_top_k', QVariant.Double)]
+        return unique_fields(fields, self.fields)
+
+
+    def pandify(self, feedback=None):
+        """ extract the criteria fields into columns for numerical processing """
+        names = [name for name in self.criteria if name not in self.spatial]
+        if len(self.rangeSources) > 1:
+            with self.pool(self.featureCount) as executor:
+                if executor is not None:
+                    self.ids, self.columns = extract_columns_parallel(
+                        self.rangeSources, names, executor,
+                        request=self.candidates(), fields=self.fields,
+                        count=self.featureCount, feedback=feedback)
+                    return
+
+        self.ids, self.columns = extract_columns(self.source, names,
+                                                 self.candidates(),
+                                                 fields=self.fields,
+                                                 count=self.featureCount,
+                                                 feedback=feedback)
+
+
+    def spatialCriteria(self, feedback=None):
+        """ add the values of the spatial criteria to the columns
+
+        Only the extracted features are measured, on the thread pool
+        for large sources. Nothing is written to the source.
+        """
+        with self.pool(len(self.ids)) as executor:
+            if len(self.rangeSources) == 1:
+                # other sources are only read on the calling thread
+                executor = None
+            self.columns.update(spatial_columns(self.rangeSources, self.ids,
+                                                self.spatial, executor,
+                                                feedback))
+
+
+    def candidates(self):
+        """ a new request for the features that can pass the filters """
+        if self.request is None:
+            return QgsFeatureRequest()
+        return QgsFeatureRequest(self.request)
+
+
+    def calculations(self, feedback=None):
+        """ normalize data & calcuate score and rank
+
+        Normalized columns are kept in self.normalized, so a later call
+        after a weight-only change skips straight to the aggregation.
+        Large sources are normalized and aggregated in row chunks on a
+        thread pool, ranking always runs over the merged scores.
+
+        :param feedback: Receives the progress of a sensitivity analysis
+            and is polled for cancelling it.
+        :type feedback: QgsFeedback
+        """
+        self.result, self.status, matrix, mask = self.scoreCriteria(
+            self.criteria, self.aggregation, self.normalized)
+        if self.samples:
+            self.sensitivityAnalysis(matrix, mask, feedback)
+
+
+    def scoreCriteria(self, criteria, aggregation, cache=None):
+        """ score and rank the extracted columns for one set of criteria
+
+        :param cache: Normalized columns to reuse, see
+            scoring.normalize_columns.
+        :type cache: dict
+
+        :returns: Scores, status codes when excluded features are
+            flagged, the normalized matrix of the rows within bounds and
+            the mask of those rows.
+        :rtype: (ScoreResult, numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        """
+        details = {}
+        with self.pool(len(self.ids)) as executor:
+            result = score_columns(self.columns, criteria, self.stats,
+                                   aggregation, self.top_k, cache, executor,
+                                   self.workers, details)
+
+        status = None
+        if self.flagExcluded:
+            status = row_status(details['columns'], criteria,
+                                details['mask'], result.mask,
+                                details['imputed'])
+        matrix, mask = details['matrix'], details['mask']
+        return result, status, matrix, mask
+
+
+    def sensitivityAnalysis(self, matrix, mask, feedback=None):
+        """ rank statistics of the rows in mask over sampled weights
+
+        Every row within bounds is ranked in every sample, also when only
+        the top K are written.
+        """
+        samples = sample_weights(criteria_weights(self.criteria),
+                                 self.samples, self.spread)
+        statistics = rank_statistics(matrix, samples, self.aggregation,
+                                     self.sampleTopK, feedback)
+        if statistics is None:
+            return
+
+        rows = np.flatnonzero(mask)
+        self.sensitivity = []
+        for values in statistics:
+            column = np.full(len(mask), np.nan)
+            column[rows] = values
+            self.sensitivity.append(column)
+
+
+    def canRescore(self, criteria, top_k=None, filters=None, samples=0):
+        """ whether rescore can update the existing output for criteria
+
+        The extracted fields, all bounds and the filters, see
+        filters.filter_key, must be unchanged, so the same features stay in the
+        output, and neither run may keep only the top K, whose membership
+        depends on the weights, or sample weights, whose statistics
+        change for every feature.
+        """
+        return (self.outputLayer is not None
+                and bool((self.outputIds >= 0).any())
+                and filters == self.filterKey
+                and not self.samples and not samples
+                and self.top_k is None and top_k is None
+                and list(criteria) == list(self.criteria)
+                and all(criteria[field]['lower'] == spec['lower']
+                        and criteria[field]['upper'] == spec['upper']
+                        and criteria[field].get('missing', 'exclude')
+                            == spec.get('missing', 'exclude')
+                        for field, spec in self.criteria.items()))
+
+
+    def rescore(self, criteria, aggregation='weighted_sum'):
+        """ score again with new weights, effects or value functions and
+        update the output layer in place, see canRescore
+
+        Only columns whose effect or value function changed are normalized
+        again, and only features whose score or rank changed are written.
+
+        :returns: Number of features updated.
+        :rtype: int
+        """
+        previous = self.result
+        self.criteria = criteria
+        self.aggregation = aggregation
+        with self.profile('calculations', len(self.ids)):
+            self.calculations()
+
+        result = self.result
+        changed = result.mask & ((result.score != previous.score)
+                                 | (result.rank != previous.rank))
+        rows = np.flatnonzero(changed)
+        with self.profile('updateSHP', len(rows)):
+            self.updateSHP(rows)
+        return len(rows)
+
+
+    def createOutputLayer(self, feedback=None):
+        """ create output memory layer holding the scored features """
+        mem_layer = QgsVectorLayer(QgsWkbTypes.displayString(self.wkbType)
+                        + "?crs=" + self.crs.authid(),
+                        "suitability_output", "memory")
+        mem_layer_data = mem_layer.dataProvider()
+
+        # copy attributes from input layer and append the result fields
+        mem_layer_data.addAttributes(self.outputFields().toList())
+        mem_layer.updateFields()
+
+        self.writeFeatures(mem_layer_data, mem_layer.fields(), feedback)
+
+        self.outputLayer = mem_layer
+
+
+    def createResultTable(self, feedback=None):
+        """ create a geometry-less memory table of join key, score and rank
+
+        The table is a few attributes per feature instead of a full copy
+        of the source, see joined_view for putting it back on a map.
+        """
+        table = QgsVectorLayer("None", "suitability_results", "memory")
+        table_data = table.dataProvider()
+
+        key_field = QgsField(self.fields.at(self.joinKeyIndex))
+        table_data.addAttributes([key_field] + self.resultFields())
+        table.updateFields()
+
+        self.writeFeatures(table_data, table.fields(), feedback,
+                           key_index=self.joinKeyIndex)
+
+        self.outputLayer = table
+
+
+    def writeFile(self, feedback=None):
+        """ write the scored features to the destination file
+
+        A GeoPackage is created empty and then filled through its data
+        provider, which commits every chunk in one transaction and hands
+        back the feature ids, so the file can be re-scored in place. Other
+        formats cannot be reopened for update and are streamed through a
+        QgsVectorFileWriter, or for attribute-only Parquet a pyarrow
+        writer when it is installed.
+        """
+        file_format, path = self.destination
+        fields = self.outputFields()
+        geometry = FORMATS[file_format][2]
+
+        if file_format in UPDATABLE:
+            writer = create_file(path, file_format, fields, self.wkbType,
+                                 self.crs)
+            del writer
+            layer = open_output(path, file_format)
+            if layer is None:
+                raise IOError('Cannot open {} for writing'.format(path))
+            self.writeFeatures(layer.dataProvider(), layer.fields(),
+                               feedback)
+        elif not geometry and arrow_available():
+            sink = ParquetSink(path, fields)
+            self.writeFeatures(sink, fields, feedback, geometry=False)
+            sink.close()
+        else:
+            writer = create_file(path, file_format, fields, self.wkbType,
+                                 self.crs)
+            self.writeFeatures(writer, fields, feedback, geometry=geometry)
+            # the file is complete once the writer is deleted
+            del writer
+
+        self.outputLayer = open_output(path, file_format)
+
+
+    def writeFeatures(self, sink, fields, feedback=None, key_index=None,
+                      geometry=True):
+        """ stream surviving features from the input layer into a sink,
+        or every feature when excluded ones are flagged
+
+        Features are read through a single QgsFeatureRequest for the
+        candidates and handed to the sink in chunks of CHUNK_SIZE, so peak
+        memory is bounded by the chunk size rather than the layer size.
+        Any QgsFeatureSink works, e.g. a memory provider or a
+        QgsVectorFileWriter.
+
+        :param sink: Destination for the scored features.
+        :type sink: QgsFeatureSink
+
+        :param fields: Fields of the sink, the input layer fields followed
+            by resultFields.
+        :type fields: QgsFields
+
+        :param feedback: Receives progress and is polled for cancellation.
+        :type feedback: QgsFeedback
+
+        :param key_index: Write only this input attribute followed by
+            resultFields, without geometry.
+        :type key_index: int
+
+        :param geometry: Copy the geometry of the features.
+        :type geometry: bool
+        """
+        if self.flagExcluded:
+            rows = np.arange(len(self.ids))
+        else:
+            rows = np.flatnonzero(self.result.mask)
+        total = max(len(rows), 1)
+
+        # output feature id of every row, -1 where nothing was written
+        self.outputIds = np.full(len(self.ids), -1, dtype=np.int64)
+
+        geometry = geometry and key_index is None
+
+        # a GeoPackage puts its own fid column in front of the fields
+        written_fields = self.fields.count() if key_index is None else 1
+        padding = [None] * (fields.count() - written_fields
+                            - len(self.resultFields()))
+
+        # the candidates only, the provider already dropped the others
+        request = self.candidates()
+        if not geometry:
+            request.setFlags(request.flags() | QgsFeatureRequest.NoGeometry)
+        if key_index is not None:
+            request.setSubsetOfAttributes([key_index])
+        # fetch only the survivors when most features are rejected
+        filter_ids = len(rows) < self.featureCount // 2
+
+        written = 0
+        chunk = []
+        chunk_rows = []
+        for batch, batch_rows in feature_batches(self.source, request,
+                                                 self.ids[rows], rows,
+                                                 filter_ids):
+            # features filtered out by the criteria bounds are not in batch
+            for feat, row in zip(batch, batch_rows.tolist()):
+                out_feat = QgsFeature(fields)
+                if geometry:
+                    out_feat.setGeometry(feat.geometry())
+                if key_index is None:
+                    attributes = feat.attributes()
+                else:
+                    attributes = [feat.attributes()[key_index]]
+                out_feat.setAttributes(padding + attributes
+                                       + self.resultValues(row))
+                chunk.append(out_feat)
+                chunk_rows.append(row)
+
+                if len(chunk) >= CHUNK_SIZE:
+                    self.addChunk(sink, chunk, chunk_rows)
+                    written += len(chunk)
+                    chunk = []
+                    chunk_rows = []
+
+                    if feedback is not None:
+                        if feedback.isCanceled():
+                            return
+                        feedback.setProgress(100 * written / total)
+
+        if chunk:
+            self.addChunk(sink, chunk, chunk_rows)
+
+
+    def resultValues(self, row):
+        """ values of the resultFields of one row, NULL score and rank
+        for a row that was not scored """
+        result = self.result
+        if result.mask[row]:
+            values = [float(result.score[row]), float(result.rank[row])]
+        else:
+            values = [None, None]
+        if self.flagExcluded:
+            values.append(STATUS[self.status[row]])
+        if self.samples:
+            values += [None if np.isnan(column[row]) else float(column[row])
+                       for column in self.sensitivity]
+        return values
+
+
+    def addChunk(self, sink, chunk, chunk_rows):
+        """ add one chunk of features to a sink and record their ids
+
+        :raises IOError: If the sink rejects the chunk.
+        """
+        if isinstance(sink, QgsVectorDataProvider):
+            # FastInsert keeps OGR from handing back the new ids
+            added = sink.addFeatures(chunk)
+        else:
+            added = sink.addFeatures(chunk, QgsFeatureSink.FastInsert)
+
+        # data providers hand back the features with their new ids
+        ok = added[0] if isinstance(added, tuple) else added
+        if not ok:
+            raise IOError(sink_error(sink))
+        if isinstance(added, tuple):
+            self.outputIds[chunk_rows] = [feat.id() for feat in added[1]]
+
+
+    def updateSHP(self, rows=None):
+        """ write the current scores back into the output layer in place
+
+        :param rows: Only update these rows, all rows when omitted.
+        :type rows: numpy.ndarray
+        """
+
+        vpr = self.outputLayer.dataProvider()
+        missing = [field for field in self.resultFields()
+                   if vpr.fieldNameIndex(field.name()) < 0]
+        if missing:
+            vpr.addAttributes(missing)
+            self.outputLayer.updateFields()
+
+        indices = [vpr.fieldNameIndex(field.name())
+                   for field in self.resultFields()]
+        result = self.result
+
+        # rows that have a feature in the output layer
+        written = self.outputIds >= 0
+        if rows is not None:
+            selected = np.zeros(len(written), dtype=bool)
+            selected[rows] = True
+            written &= selected
+        if self.flagExcluded:
+            # unscored features stay, with a NULL score and their status
+            kept = np.flatnonzero(written)
+            dropped = np.empty(0, dtype=np.int64)
+        else:
+            kept = np.flatnonzero(written & result.mask)
+            dropped = np.flatnonzero(written & ~result.mask)
+
+        changes = {int(self.outputIds[row]):
+                       dict(zip(indices, self.resultValues(row)))
+                   for row in kept}
+
+        # apply all changes and deletions in one provider call each
+        vpr.changeAttributeValues(changes)
+        vpr.deleteFeatures(self.outputIds[dropped].tolist())
+        self.outputIds[dropped] = -1
+
+
+class ScenarioPipeline(SuitabilityPipeline):
+    """ scores several sets of criteria, scenarios, in one analysis
+
+    The fields of all scenarios are extracted once, see scenario_criteria,
+    and every scenario is scored from those shared columns. The output
+    holds each feature scored by any scenario once, with a score_<name>
+    and rank_<name> field per scenario, written together with the
+    features instead of updated per scenario.
+    """
+
+    def __init__(self, source, scenarios, stats=None, join=False,
+                 profiler=None, workers=1, selected_only=False,
+                 extent=None, aoi=None, destination=None,
+                 flag_excluded=False, spatial=None):
+        """Constructor.
+
+        :param scenarios: Mapping of scenario name to a pair of criteria
+            spec and aggregation.
+        :type scenarios: dict
+
+        See SuitabilityPipeline for the other parameters. A status field
+        is added per scenario when excluded features are flagged.
+        """
+        super().__init__(source, scenario_criteria(scenarios), stats,
+                         join=join, profiler=profiler, workers=workers,
+                         selected_only=selected_only, extent=extent,
+                         aoi=aoi, destination=destination,
+                         flag_excluded=flag_excluded, spatial=spatial)
+        self.scenarios = scenarios
+        self.suffixes = scenario_suffixes(scenarios)
+        self.results = {}
+        self.statuses = {}
+
+
+    def resultFields(self):
+        """ score and rank of every scenario, each followed by its status
+        if excluded features are flagged """
+        fields = []
+        for name in self.scenarios:
+            suffix = self.suffixes[name]
+            fields += [QgsField('score_' + suffix, QVariant.Double),
+                       QgsField('rank_' + suffix, QVariant.Double)]
+            if self.flagExcluded:
+                fields.append(QgsField('status_' + suffix, QVariant.String))
+        return unique_fields(fields, self.fields)
+
+
+    def calculations(self, feedback=None):
+        """ score every scenario from the shared columns
+
+        The result mask holds the rows scored by any scenario, which are
+        the rows written unless excluded features are flagged.
+        """
+        self.results = {}
+        self.statuses = {}
+        for done, (name, (criteria, aggregation)) in enumerate(
+                self.scenarios.items()):
+            if feedback is not None:
+                if feedback.isCanceled():
+                    return
+                feedback.setProgress(100 * done / len(self.scenarios))
+            self.results[name], self.statuses[name], _, _ = \
+                self.scoreCriteria(criteria, aggregation)
+
+        scored = np.zeros(len(self.ids), dtype=bool)
+        for result in self.results.values():
+            scored |= result.mask
+        self.result = ScoreResult(scored, None, None)
+
+
+    def canRescore(self, criteria, top_k=None, filters=None, samples=0):
+        """ a comparison is always run again in full """
+        return False
+
+
+    def resultValues(self, row):
+        """ values of the resultFields of one row """
+        values = []
+        for name, result in self.results.items():
+            if result.mask[row]:
+                values += [float(result.score[row]), float(result.rank[row])]
+            else:
+                values += [None, None]
+            if self.flagExcluded:
+                values.append(STATUS[self.statuses[name][row]])
+        return values
+
+
+def sink_error(sink):
+    """ the reason a sink gave for rejecting features, as far as it
+    tells one """
+    message = ''
+    if hasattr(sink, 'lastError'):
+        message = sink.lastError()
+    elif hasattr(sink, 'errorMessage'):
+        message = sink.errorMessage()
+    return message or 'Could not write features to the output'
+
+
+def configured_workers():
+    """ threads an analysis may use, from the SuitabilityAnalysis/workers
+    setting and one per CPU by default """
+    workers = QSettings().value('SuitabilityAnalysis/workers',
+                                os.cpu_count() or 1, type=int)
+    return max(workers, 1)
+
+
+def join_key_index(layer):
+    """ index of the attribute identifying a layer's features for joins
+
+    Only single-column primary keys of providers that read from storage
+    qualify, a memory layer's source cannot be reopened as a view.
+
+    :returns: Attribute index or None.
+    :rtype: int
+    """
+    if layer.providerType() == 'memory':
+        return None
+    keys = layer.primaryKeyAttributes()
+    if len(keys) != 1:
+        return None
+    return keys[0]
+
+
+def joined_view(layer, table):
+    """ a new layer on the source of layer with the result table joined
+
+    The view reopens the same data source, so the input layer itself and
+    its data are left untouched and no geometry is copied.
+
+    :param layer: Analysed layer.
+    :type layer: QgsVectorLayer
+
+    :param table: Result table from SuitabilityPipeline.createResultTable,
+        already added to the project.
+    :type table: QgsVectorLayer
+
+    :rtype: QgsVectorLayer
+    """
+    key_name = layer.fields().at(join_key_index(layer)).name()
+    view = QgsVectorLayer(layer.source(), "suitability_output",
+                          layer.providerType())
+
+    join = QgsVectorLayerJoinInfo()
+    join.setJoinLayer(table)
+    join.setJoinFieldName(key_name)
+    join.setTargetFieldName(key_name)
+    join.setJoinFieldNamesSubset(table.fields().names()[1:])
+    join.setPrefix('')
+    join.setUsingMemoryCache(True)
+    view.addJoin(join)
+
+    return view
+
+
+def scenario_criteria(scenarios):
+    """ criteria covering the fields of every scenario, to extract once
+
+    A field used by every scenario gets the widest of their bounds and
+    the imputing policy of any scenario that imputes it, which turns off
+    the bounds pushdown, see SuitabilityPipeline. Fields some scenario
+    does not use are unbounded. Bounds pushed down to the provider then
+    keep every feature that any scenario can score.
+
+    :param scenarios: Mapping of scenario name to (criteria, aggregation).
+    :type scenarios: dict
+
+    :rtype: dict
+    """
+    union = {}
+    for criteria, _ in scenarios.values():
+        for field, spec in criteria.items():
+            if field not in union:
+                union[field] = dict(spec)
+                continue
+            merged = union[field]
+            merged['lower'] = min(merged['lower'], spec['lower'])
+            merged['upper'] = max(merged['upper'], spec['upper'])
+            if spec.get('missing', 'exclude') != 'exclude':
+                merged['missing'] = spec['missing']
+
+    for field, spec in union.items():
+        if not all(field in criteria for criteria, _ in scenarios.values()):
+            spec['lower'], spec['upper'] = -np.inf, np.inf
+    return union
+
+
+def unique_fields(fields, existing):
+    """ fields renamed with a number where an existing field, e.g. of an
+    analysed earlier output, already has their name
+
+    Compared case-insensitively like scenario_suffixes, so a result never
+    overwrites or is dropped in favour of an input attribute.
+
+    :param fields: New fields, renamed in place.
+    :type fields: list
+
+    :param existing: Fields the new ones are appended to.
+    :type existing: QgsFields
+
+    :rtype: list
+    """
+    taken = {name.lower() for name in existing.names()}
+    for field in fields:
+        base = field.name()
+        name = base
+        number = 1
+        while name.lower() in taken:
+            number += 1
+            name = '{}_{}'.format(base, number)
+        field.setName(name)
+        taken.add(name.lower())
+    return fields
+
+
+def scenario_suffixes(names):
+    """ field name suffix of every scenario, its name reduced to letters,
+    digits and underscores and numbered where that makes two alike
+
+    :rtype: dict
+    """
+    suffixes = {}
+    for name in names:
+        base = re.sub(r'\W+', '_', name).strip('_') or 'scenario'
+        suffix = base
+        number = 1
+        # field names compare case-insensitively in most formats
+        while suffix.lower() in {used.lower() for used in suffixes.values()}:
+            number += 1
+            suffix = '{}_{}'.format(base, number)
+        suffixes[name] = suffix
+    return suffixes
+
+
+class _StepFeedback(QgsFeedback):
+    """ maps the 0..100 progress of one stage onto a slice of a parent """
+
+    def __init__(self, parent, start, end):
+        super().__init__()
+        self.parent = parent
+        self.start = start
+        self.end = end
+        if parent.isCanceled():
+            self.cancel()
+        # cancel() is thread safe, deliver it even without an event loop
+        parent.canceled.connect(self.cancel, Qt.DirectConnection)
+        self.progressChanged.connect(self.forwardProgress)
+
+    def forwardProgress(self, progress):
+        self.parent.setProgress(
+            self.start + (self.end - self.start) * progress / 100)
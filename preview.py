@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+"""
+
+import time
+
+import numpy as np
+
+from qgis.core import (QgsGradientColorRamp, QgsGraduatedSymbolRenderer,
+                       QgsProject, QgsRendererRange, QgsSymbol)
+
+# number of graduated classes the preview styles the output with
+CLASSES = 5
+
+
+class WeightPreview:
+    """ re-styles a memory output layer while weight sliders are dragged
+
+    The normalized criteria are computed once, in memory, for the criteria
+    of the form. After that a weight change evaluates the weighted sum
+    over the criteria matrix and writes it into the score attribute of
+    the memory provider in one call, so the renderer classifies by a
+    plain attribute. The written scores are put back by finish.
+    """
+
+    def __init__(self, pipeline, criteria):
+        """Constructor.
+
+        :param pipeline: Completed pipeline whose outputLayer is a memory
+            layer on the map, see SuitabilityPipeline.canRescore.
+        :type pipeline: SuitabilityPipeline
+
+        :param criteria: Criteria of the form, with the same fields and
+            bounds as the pipeline's.
+        :type criteria: dict
+        """
+        self.pipeline = pipeline
+        self.layer = pipeline.outputLayer
+        self.layerId = self.layer.id()
+        self.scoreField = pipeline.resultFields()[0].name()
+        self.fields = list(criteria)
+        _, _, self.matrix, mask = pipeline.scoreCriteria(
+            criteria, 'weighted_sum', pipeline.normalized)
+        self.rows = np.flatnonzero(mask)
+        self.outputIds = pipeline.outputIds[self.rows].tolist()
+        self.renderer = None
+
+
+    def preload(self):
+        """ switch the output layer to a graduated renderer classified by
+        the score attribute """
+        self.renderer = QgsGraduatedSymbolRenderer(self.scoreField)
+        self.renderer.setSourceSymbol(
+            QgsSymbol.defaultSymbol(self.layer.geometryType()))
+        self.renderer.setSourceColorRamp(QgsGradientColorRamp())
+        self.layer.setRenderer(self.renderer)
+
+
+    def preview(self, weights):
+        """ write the scores for new weights and restyle the layer
+
+        :param weights: Mapping of criteria field to weight.
+        :type weights: dict
+
+        :returns: Seconds spent, excluding the asynchronous map redraw.
+        :rtype: float
+        """
+        start = time.perf_counter()
+
+        w = np.array([weights[field] for field in self.fields],
+                     dtype=np.float64)
+        score = self.matrix @ w
+        self.writeScores(score)
+        self.setClasses(score)
+        return time.perf_counter() - start
+
+
+    def finish(self):
+        """ put the scores of the last run back and style by them """
+        if QgsProject.instance().mapLayer(self.layerId) is None:
+            return
+        result = self.pipeline.result
+        self.writeScores(result.score[self.rows])
+        self.setClasses(result.score[result.mask])
+
+
+    def writeScores(self, score):
+        """ score of every previewed feature in one provider call """
+        index = self.layer.fields().indexOf(self.scoreField)
+        self.layer.dataProvider().changeAttributeValues(
+            {fid: {index: value}
+             for fid, value in zip(self.outputIds, score.tolist())})
+
+
+    def setClasses(self, score):
+        """ quantile classes of score on the score attribute """
+        if len(score) == 0:
+            return
+        breaks = np.quantile(score, np.linspace(0, 1, CLASSES + 1))
+
+        ranges = []
+        for i in range(CLASSES):
+            symbol = self.renderer.sourceSymbol().clone()
+            symbol.setColor(self.renderer.sourceColorRamp().color(
+                i / (CLASSES - 1)))
+            ranges.append(QgsRendererRange(
+                float(breaks[i]), float(breaks[i + 1]), symbol,
+                '{:.1f} - {:.1f}'.format(breaks[i], breaks[i + 1])))
+
+        self.renderer.deleteAllClasses()
+        for renderer_range in ranges:
+            self.renderer.addClassRange(renderer_range)
+        self.layer.triggerRepaint()
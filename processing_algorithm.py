@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+"""
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsCoordinateTransform, QgsFeatureRequest,
+                       QgsGeometry, QgsProcessing, QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterExtent,
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterMatrix,
+                       QgsProcessingParameterNumber)
+
+from .profiling import StageProfiler
+
+# names of scoring.AGGREGATIONS, repeated here because the provider is
+# registered at QGIS startup and importing scoring would load numpy
+AGGREGATIONS = ['weighted_sum', 'weighted_product', 'owa']
+
+# likewise for scoring.MISSING_POLICIES
+MISSING_POLICIES = ['exclude', 'mean', 'median', 'worst']
+
+
+class SuitabilityAlgorithm(QgsProcessingAlgorithm):
+    """ scores and ranks the features of a layer against weighted criteria
+
+    Runs the same pipeline as the plugin dialog, so it can be used from
+    qgis_process, batch mode and graphical models.
+    """
+
+    INPUT = 'INPUT'
+    CRITERIA = 'CRITERIA'
+    AGGREGATION = 'AGGREGATION'
+    TOP_K = 'TOP_K'
+    EXTENT = 'EXTENT'
+    AREA = 'AREA'
+    MISSING = 'MISSING'
+    FLAG_EXCLUDED = 'FLAG_EXCLUDED'
+    SAMPLES = 'SAMPLES'
+    SPREAD = 'SPREAD'
+    SAMPLE_TOP_K = 'SAMPLE_TOP_K'
+    OUTPUT = 'OUTPUT'
+
+    # columns of the criteria table, one row per criterion
+    HEADERS = ['Field', 'Lower', 'Upper', 'Weight', 'Effect', 'Method']
+
+    def tr(self, string):
+        return QCoreApplication.translate('SuitabilityAlgorithm', string)
+
+    def createInstance(self):
+        return SuitabilityAlgorithm()
+
+    def name(self):
+        return 'suitabilityanalysis'
+
+    def displayName(self):
+        return self.tr('Suitability analysis')
+
+    def shortHelpString(self):
+        return self.tr(
+            'Scores and ranks features against weighted criteria. Each row '
+            'of the criteria table names a numeric field, the lower and '
+            'upper bounds a feature must fall within, the weight of the '
+            'criterion and its effect, "+" when higher values are better '
+            'or "-" when lower values are better, and its value function: '
+            'linear, zscore, percentile, sigmoid(midpoint, steepness) or '
+            'piecewise(x:y, x:y, ...). Instead of a field, a row may name '
+            'a spatial criterion against a second layer, given by name, id '
+            'or path: distance(layer) is the distance to its nearest '
+            'feature in map units of the input layer, overlap(layer) the '
+            'percentage of the feature covered by its polygons. Features '
+            'outside any bounds are '
+            'left out of the output, as are features outside the optional '
+            'extent and area of interest polygons. NULL values exclude '
+            'their feature, or are imputed with the mean or median of the '
+            'field or its worst value. Excluded features can be kept with '
+            'a NULL score and a status field instead. With weight samples, '
+            'the weights are varied at random by up to the weight spread '
+            'and the mean rank, its standard deviation and the share of '
+            'samples ranking each feature in the top K are added.')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.INPUT,
+            self.tr('Input layer'),
+            [QgsProcessing.TypeVectorAnyGeometry]))
+
+        self.addParameter(QgsProcessingParameterMatrix(
+            self.CRITERIA,
+            self.tr('Criteria'),
+            numberRows=1,
+            hasFixedNumberRows=False,
+            headers=self.HEADERS))
+
+        self.addParameter(QgsProcessingParameterEnum(
+            self.AGGREGATION,
+            self.tr('Aggregation'),
+            options=AGGREGATIONS,
+            defaultValue=0))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.TOP_K,
+            self.tr('Keep only the best K features (0 keeps all)'),
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=0,
+            defaultValue=0))
+
+        self.addParameter(QgsProcessingParameterExtent(
+            self.EXTENT,
+            self.tr('Only features within extent'),
+            optional=True))
+
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.AREA,
+            self.tr('Only features intersecting area of interest'),
+            [QgsProcessing.TypeVectorPolygon],
+            optional=True))
+
+        self.addParameter(QgsProcessingParameterEnum(
+            self.MISSING,
+            self.tr('NULL values'),
+            options=MISSING_POLICIES,
+            defaultValue=0))
+
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.FLAG_EXCLUDED,
+            self.tr('Keep excluded features with a status field'),
+            defaultValue=False))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.SAMPLES,
+            self.tr('Weight samples for sensitivity analysis (0 skips it)'),
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=0,
+            defaultValue=0))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.SPREAD,
+            self.tr('Weight spread (%)'),
+            type=QgsProcessingParameterNumber.Double,
+            minValue=1,
+            maxValue=100,
+            defaultValue=20))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.SAMPLE_TOP_K,
+            self.tr('K of the share of samples in the top K'),
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=1,
+            defaultValue=10))
+
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT,
+            self.tr('Suitability output')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        from .pipeline import SuitabilityPipeline, configured_workers
+        from .spatial import spatial_criteria
+
+        source = self.parameterAsSource(parameters, self.INPUT, context)
+        if source is None:
+            raise QgsProcessingException(
+                self.invalidSourceError(parameters, self.INPUT))
+
+        matrix = self.parameterAsMatrix(parameters, self.CRITERIA, context)
+        criteria = self.parseCriteria(matrix, source.fields(), context)
+        aggregation = AGGREGATIONS[self.parameterAsEnum(
+            parameters, self.AGGREGATION, context)]
+
+        top_k = self.parameterAsInt(parameters, self.TOP_K, context)
+
+        missing = MISSING_POLICIES[self.parameterAsEnum(
+            parameters, self.MISSING, context)]
+        for spec in criteria.values():
+            spec["missing"] = missing
+
+        extent = None
+        if parameters.get(self.EXTENT) is not None:
+            extent = self.parameterAsExtent(parameters, self.EXTENT, context,
+                                            source.sourceCrs())
+        aoi = self.areaOfInterest(parameters, context, source.sourceCrs())
+
+        try:
+            spatial = spatial_criteria(criteria, source.sourceCrs(),
+                                       context.transformContext(), context)
+        except ValueError as e:
+            raise QgsProcessingException(str(e))
+
+        pipeline = SuitabilityPipeline(source, criteria,
+                                       aggregation=aggregation,
+                                       top_k=top_k or None,
+                                       profiler=StageProfiler(),
+                                       workers=configured_workers(),
+                                       extent=extent, aoi=aoi,
+                                       flag_excluded=self.parameterAsBool(
+                                           parameters, self.FLAG_EXCLUDED,
+                                           context),
+                                       samples=self.parameterAsInt(
+                                           parameters, self.SAMPLES, context),
+                                       spread=self.parameterAsDouble(
+                                           parameters, self.SPREAD,
+                                           context) / 100,
+                                       sample_top_k=self.parameterAsInt(
+                                           parameters, self.SAMPLE_TOP_K,
+                                           context),
+                                       spatial=spatial)
+        (sink, dest_id) = self.parameterAsSink(
+            parameters, self.OUTPUT, context,
+            pipeline.outputFields(), source.wkbType(), source.sourceCrs())
+        if sink is None:
+            raise QgsProcessingException(
+                self.invalidSinkError(parameters, self.OUTPUT))
+
+        try:
+            pipeline.run(feedback, sink)
+        except IOError:
+            raise QgsProcessingException(
+                self.writeFeatureError(sink, parameters, self.OUTPUT))
+        feedback.pushInfo(pipeline.profiler.report())
+
+        return {self.OUTPUT: dest_id}
+
+    def areaOfInterest(self, parameters, context, crs):
+        """ union of the area of interest polygons in crs, or None """
+        area = self.parameterAsSource(parameters, self.AREA, context)
+        if area is None:
+            return None
+
+        request = QgsFeatureRequest().setNoAttributes()
+        aoi = QgsGeometry.unaryUnion([feat.geometry() for feat in
+                                      area.getFeatures(request)])
+        aoi.transform(QgsCoordinateTransform(area.sourceCrs(), crs,
+                                             context.transformContext()))
+        if aoi.isEmpty():
+            return None
+        return aoi
+
+    def parseCriteria(self, matrix, fields, context):
+        """ build the criteria spec from the flattened criteria table,
+        checked like the dialog checks its criteria table """
+        from .profiles import validate_criteria
+
+        columns = len(self.HEADERS)
+        if len(matrix) == 0 or len(matrix) % columns != 0:
+            raise QgsProcessingException(self.tr(
+                'Criteria table must have {} columns per row').format(columns))
+
+        criteria = {}
+        for start in range(0, len(matrix), columns):
+            field_name, lower, upper, weight, effect, method = \
+                matrix[start:start + columns]
+
+            try:
+                criteria[field_name] = {
+                    "lower": float(lower),
+                    "upper": float(upper),
+                    "weight": float(weight),
+                    "effect": str(effect).strip(),
+                    "method": str(method).strip()
+                }
+            except ValueError as e:
+                raise QgsProcessingException(self.tr(
+                    'Invalid criteria for field "{}": {}').format(
+                    field_name, e))
+
+        problems = validate_criteria(criteria, fields, context)
+        if problems:
+            raise QgsProcessingException('\n'.join(problems))
+
+        # weights are checked as entered and analysed as whole numbers
+        for spec in criteria.values():
+            spec["weight"] = int(spec["weight"])
+        return criteria
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+"""
+
+from qgis.PyQt.QtGui import QIcon
+from qgis.core import QgsProcessingProvider
+
+from .processing_algorithm import SuitabilityAlgorithm
+
+
+class SuitabilityProvider(QgsProcessingProvider):
+    """ Processing provider exposing the suitability analysis algorithms """
+
+    def loadAlgorithms(self):
+        self.addAlgorithm(SuitabilityAlgorithm())
+
+    def id(self):
+        return 'suitability'
+
+    def name(self):
+        return self.tr('Suitability analysis')
+
+    def icon(self):
+        return QIcon(':/plugins/suitability_analysis/icon.png')
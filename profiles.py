@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ Named criteria profiles, stored as JSON in the project or in the user's
+ QGIS profile directory.
+
+ A profile is a dict with the criteria as read from the criteria table,
+ the aggregation, and the fingerprint and cached min/max of the layer it
+ was saved for:
+
+     {"criteria": {field: {"lower", "upper", "weight", "effect",
+                           "method"}},
+      "aggregation": "weighted_sum",
+      "fingerprint": [...],
+      "stats": {field: [min, max]}}
+"""
+
+import json
+import os
+import re
+
+from qgis.core import QgsApplication, QgsProject
+
+# project scope and key holding the project's profiles as one JSON object
+PROJECT_SCOPE = 'SuitabilityAnalysis'
+PROJECT_KEY = 'profiles'
+
+# directory below the user's QGIS profile holding one file per profile
+PROFILE_DIR = 'suitability_profiles'
+
+# characters no file name may hold on some platform, and the device
+# names Windows reserves
+_INVALID_CHARACTERS = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+_RESERVED_NAMES = re.compile(r'^(con|prn|aux|nul|com\d|lpt\d)$', re.I)
+
+
+def layer_fingerprint(layer):
+    """ cheap identification of a layer's data, compared to decide
+    whether statistics saved with a profile still hold
+
+    Made of the data source, feature count, field names and types, extent
+    and, for files, the modification time, including that of a SQLite
+    write-ahead log still holding writes.
+
+    :rtype: list
+    """
+    path = layer.source().split('|')[0]
+    modified = None
+    if os.path.isfile(path):
+        modified = max(os.path.getmtime(name) for name in (path, path + '-wal')
+                       if os.path.isfile(name))
+    return [layer.providerType(), layer.source(), layer.featureCount(),
+            [[field.name(), field.typeName()] for field in layer.fields()],
+            layer.extent().toString(), modified]
+
+
+def fingerprint_holds(layer, fingerprint):
+    """ whether statistics saved with fingerprint still describe layer
+
+    Only a file layer without unsaved edits can tell, values of a database
+    table or an edit buffer may change behind the same fingerprint.
+
+    :param fingerprint: Fingerprint saved with the statistics, see
+        layer_fingerprint.
+    :type fingerprint: list
+    """
+    if layer.isModified():
+        return False
+    current = layer_fingerprint(layer)
+    return current[-1] is not None and fingerprint == current
+
+
+def validate_criteria(criteria, fields, context=None):
+    """ problems that would make an analysis of criteria fail or mislead
+
+    :param criteria: Criteria spec with the weights as entered, see the
+        module docstring.
+    :type criteria: dict
+
+    :param fields: Fields of the layer to analyse.
+    :type fields: QgsFields
+
+    :param context: Processing context to resolve the layers of spatial
+        criteria with, see spatial.resolve_layer.
+    :type context: QgsProcessingContext
+
+    :returns: One message per problem, empty if criteria are valid.
+    :rtype: list
+    """
+    from .scoring import parse_method
+    from .spatial import parse_spatial, resolve_layer, spatial_problem
+
+    if not criteria:
+        return ['Add at least one field to analyse']
+
+    problems = []
+    for field, spec in criteria.items():
+        spatial = parse_spatial(field)
+        index = fields.lookupField(field)
+        if spatial is not None:
+            problem = spatial_problem(field,
+                                      resolve_layer(spatial[1], context))
+            if problem is not None:
+                problems.append(problem)
+        elif index < 0:
+            problems.append('Field "{}" does not exist'.format(field))
+        elif not fields.at(index).isNumeric():
+            problems.append('Field "{}" is not numeric'.format(field))
+        if spec['lower'] > spec['upper']:
+            problems.append('Lower bound of "{}" is above its upper '
+                            'bound'.format(field))
+        if spec['weight'] < 0:
+            problems.append('Weight of "{}" is negative'.format(field))
+        if spec['effect'] not in ('+', '-'):
+            problems.append('Effect of "{}" must be "+" or "-"'.format(
+                field))
+        try:
+            parse_method(spec.get('method'))
+        except ValueError as e:
+            problems.append('{} for "{}"'.format(e, field))
+
+    if round(sum(spec['weight'] for spec in criteria.values())) != 100:
+        problems.append('Field weights must sum to 100')
+    return problems
+
+
+def profile_names():
+    """ names of the project's profiles followed by the user's """
+    names = list(_project_profiles())
+    names += [name for name in sorted(_user_profiles()) if name not in names]
+    return names
+
+
+def load_profile(name):
+    """ profile saved under name, project profiles first
+
+    :rtype: dict
+    :raises KeyError: If there is no such profile.
+    """
+    profiles = _project_profiles()
+    if name in profiles:
+        return profiles[name]
+
+    path = _user_profiles().get(name)
+    if path is None:
+        raise KeyError(name)
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_profile(name, profile, in_project=False):
+    """ store a profile under name, replacing one of the same name
+
+    :raises ValueError: If name cannot be a file name, for profiles
+        saved in the user's profile directory.
+    :raises OSError: If the profile file cannot be written.
+    """
+    if in_project:
+        profiles = _project_profiles()
+        profiles[name] = profile
+        QgsProject.instance().writeEntry(PROJECT_SCOPE, PROJECT_KEY,
+                                         json.dumps(profiles))
+        return
+
+    if (_INVALID_CHARACTERS.search(name) or _RESERVED_NAMES.match(name)
+            or name.startswith('.') or name.endswith((' ', '.'))):
+        raise ValueError('"{}" cannot be used as a file name'.format(name))
+
+    directory = _user_directory()
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name + '.json'), 'w') as f:
+        json.dump(profile, f, indent=2)
+
+
+def _project_profiles():
+    """ profiles saved in the current project, by name """
+    value, ok = QgsProject.instance().readEntry(PROJECT_SCOPE, PROJECT_KEY)
+    if not ok or not value:
+        return {}
+    return json.loads(value)
+
+
+def _user_directory():
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), PROFILE_DIR)
+
+
+def _user_profiles():
+    """ paths of the profiles in the user's profile directory, by name """
+    directory = _user_directory()
+    if not os.path.isdir(directory):
+        return {}
+    return {filename[:-len('.json')]: os.path.join(directory, filename)
+            for filename in os.listdir(directory)
+            if filename.endswith('.json')}
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ Per-stage instrumentation of the pipeline. Plain Python, so it can be
+ used from the benchmarks without qgis.
+"""
+
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# number of functions kept from a cProfile run
+PROFILE_LINES = 30
+
+# stages currently tracing memory, in any profiler of the process
+_tracing_lock = threading.Lock()
+_tracing_stages = 0
+
+# held by the stage running under cProfile, Python 3.12 and later allow
+# only one active profiler per process
+_profile_lock = threading.Lock()
+
+
+class StageProfiler:
+    """ records wall time, throughput and peak traced memory per stage
+
+    tracemalloc is process wide. It is started by the first stage that
+    traces memory and left running, since stopping it would blank the
+    figures of analyses running at the same time. The peak is only reset
+    when no other stage is tracing, so the peak of overlapping stages
+    also counts each other's allocations. It sees Python and NumPy
+    allocations but not memory allocated inside QGIS, and slows down
+    every Python allocation while it runs.
+
+    Only one stage of the process runs under cProfile at a time. A stage
+    starting while another is profiled runs unprofiled, which its record
+    notes.
+    """
+
+    def __init__(self, trace_memory=False, profile_stages=()):
+        """Constructor.
+
+        :param trace_memory: Record peak traced memory per stage, which
+            makes feature loops several times slower.
+        :type trace_memory: bool
+
+        :param profile_stages: Names of stages to run under cProfile.
+        :type profile_stages: iterable
+        """
+        self.trace_memory = trace_memory
+        self.profile_stages = set(profile_stages)
+        self.records = []
+
+
+    @contextmanager
+    def stage(self, name, features=None):
+        """ measure the body of a with block as one stage
+
+        :param name: Stage name, e.g. the pipeline method.
+        :type name: str
+
+        :param features: Number of features the stage processes.
+        :type features: int
+        """
+        if self.trace_memory:
+            _start_tracing()
+
+        profiler = None
+        skipped = False
+        if name in self.profile_stages:
+            profiler, skipped = _start_profile()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+
+            record = {'stage': name, 'seconds': seconds}
+            if features is not None:
+                record['features'] = features
+                record['features_per_second'] = features / max(seconds, 1e-9)
+
+            if profiler is not None:
+                profiler.disable()
+                _profile_lock.release()
+                stream = io.StringIO()
+                pstats.Stats(profiler, stream=stream) \
+                    .sort_stats('cumulative').print_stats(PROFILE_LINES)
+                record['profile'] = stream.getvalue()
+            elif skipped:
+                record['profile'] = ('not profiled, another stage was '
+                                     'running under a profiler')
+
+            if self.trace_memory:
+                record['peak_bytes'] = _stop_tracing()
+
+            self.records.append(record)
+
+
+    def totalSeconds(self):
+        """ wall time of all recorded stages """
+        return sum(record['seconds'] for record in self.records)
+
+
+    def report(self):
+        """ one line per stage, followed by any cProfile output """
+        lines = []
+        profiles = []
+        for record in self.records:
+            line = '{:<18} {:>9.3f} s'.format(record['stage'],
+                                             record['seconds'])
+            if 'features' in record:
+                line += ' {:>12.0f} features/s'.format(
+                    record['features_per_second'])
+            if 'peak_bytes' in record:
+                line += ' {:>9.1f} MB peak'.format(
+                    record['peak_bytes'] / 2 ** 20)
+            lines.append(line)
+
+            if 'profile' in record:
+                profiles.append('cProfile of {}:\n{}'.format(
+                    record['stage'], record['profile']))
+
+        return '\n'.join(lines + profiles)
+
+
+    def writeJson(self, path):
+        """ write the stage records to a JSON profile file """
+        with open(path, 'w') as f:
+            json.dump(self.records, f, indent=2)
+
+
+def _start_profile():
+    """ an enabled cProfile.Profile, or None if another stage holds the
+    profiler
+
+    :returns: Profiler and whether profiling was skipped.
+    :rtype: (cProfile.Profile, bool)
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None, True
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # a profiler outside the plugin, e.g. a debugger, is active
+        _profile_lock.release()
+        return None, True
+    return profiler, False
+
+
+def _start_tracing():
+    """ start tracemalloc once per process and reset its peak unless
+    another stage is being traced """
+    global _tracing_stages
+
+    with _tracing_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif _tracing_stages == 0 and hasattr(tracemalloc, 'reset_peak'):
+            # Python 3.9 and later
+            tracemalloc.reset_peak()
+        _tracing_stages += 1
+
+
+def _stop_tracing():
+    """ peak traced memory in bytes for a stage started by _start_tracing """
+    global _tracing_stages
+
+    with _tracing_lock:
+        _tracing_stages -= 1
+        return tracemalloc.get_traced_memory()[1]
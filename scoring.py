@@ -0,0 +1,506 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ Headless scoring engine. Works on plain NumPy arrays and must not import
+ anything from qgis, so it can be benchmarked and batch-run outside QGIS.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+
+ScoreResult = namedtuple('ScoreResult', ['mask', 'score', 'rank'])
+ScoreResult.__doc__ = """ result of scoring a column block.
+
+mask is True for rows that pass every criterion's bounds, score and rank
+have one entry per input row and are NaN where mask is False.
+"""
+
+# ways of handling a NaN (NULL) criterion value, selected per criterion
+# under "missing". exclude drops the row, mean and median impute the
+# statistic of the present values within bounds, worst imputes the worst
+# of them for the criterion's effect
+MISSING_POLICIES = ('exclude', 'mean', 'median', 'worst')
+
+# row states reported by row_status, in code order
+STATUS = ('scored', 'imputed', 'missing', 'out_of_bounds', 'below_top_k')
+
+
+def criteria_mask(columns, criteria):
+    """ combined boolean mask of rows within every criterion's bounds
+
+    :param columns: Mapping of field name to a float64 array. All arrays
+        must have the same length.
+    :type columns: dict
+
+    :param criteria: Mapping of field name to a dict with "lower", "upper",
+        "weight" and "effect" keys, as built by fetchCriteria.
+    :type criteria: dict
+
+    :returns: Boolean array, False for rows outside any bounds or NaN.
+    :rtype: numpy.ndarray
+    """
+    mask = None
+    for field, spec in criteria.items():
+        values = columns[field]
+        within = (values >= spec['lower']) & (values <= spec['upper'])
+        mask = within if mask is None else mask & within
+
+    if mask is None:
+        return np.zeros(0, dtype=bool)
+    return mask
+
+
+def fill_missing(columns, criteria):
+    """ replace NaN values by the criteria's missing policies
+
+    :returns: Columns with the imputed criteria copied and filled, the
+        others shared with columns, and a boolean array of the rows with
+        any imputed value. Rows of a criterion without any present value
+        within bounds stay NaN.
+    :rtype: (dict, numpy.ndarray)
+
+    :raises ValueError: For unknown policies.
+    """
+    n = len(columns[next(iter(criteria))]) if criteria else 0
+    filled = dict(columns)
+    imputed = np.zeros(n, dtype=bool)
+    for field, spec in criteria.items():
+        policy = spec.get('missing', 'exclude')
+        if policy not in MISSING_POLICIES:
+            raise ValueError('Unknown missing value policy "{}"'.format(
+                policy))
+        if policy == 'exclude':
+            continue
+
+        values = np.asarray(columns[field], dtype=np.float64)
+        missing = np.isnan(values)
+        present = values[~missing]
+        present = present[(present >= spec['lower'])
+                          & (present <= spec['upper'])]
+        if not missing.any() or len(present) == 0:
+            continue
+
+        if policy == 'mean':
+            fill = present.mean()
+        elif policy == 'median':
+            fill = np.median(present)
+        elif spec['effect'] == "-":
+            fill = present.max()
+        else:
+            fill = present.min()
+
+        values = values.copy()
+        values[missing] = fill
+        filled[field] = values
+        imputed |= missing
+
+    return filled, imputed
+
+
+def row_status(columns, criteria, passed, scored, imputed):
+    """ why each row was or was not scored, as indices into STATUS
+
+    :param columns: Columns after fill_missing, NaN left in them are
+        missing values that excluded their row.
+    :type columns: dict
+
+    :param passed: Rows within every criterion's bounds, see
+        criteria_mask.
+    :type passed: numpy.ndarray
+
+    :param scored: Rows that got a score, see ScoreResult.mask.
+    :type scored: numpy.ndarray
+
+    :param imputed: Rows with an imputed value, see fill_missing.
+    :type imputed: numpy.ndarray
+
+    :rtype: numpy.ndarray
+    """
+    status = np.full(len(passed), STATUS.index('out_of_bounds'),
+                     dtype=np.int8)
+    for field in criteria:
+        status[np.isnan(columns[field]) & ~passed] = STATUS.index('missing')
+    status[passed] = STATUS.index('below_top_k')
+    status[scored] = STATUS.index('scored')
+    status[scored & imputed] = STATUS.index('imputed')
+    return status
+
+
+def parse_method(text):
+    """ split a value function cell such as "sigmoid(50, 0.2)" or
+    "piecewise(0:0, 50:1, 100:0.2)" into its name and parameters
+
+    :returns: Registered value function name and a tuple of floats.
+    :rtype: (str, tuple)
+
+    :raises ValueError: For unknown names or malformed parameters.
+    """
+    text = (text or 'linear').strip()
+    name, _, args = text.partition('(')
+    name = name.strip().lower() or 'linear'
+    if name not in VALUE_FUNCTIONS:
+        raise ValueError('Unknown value function "{}"'.format(name))
+
+    args = args.rstrip(') ').replace(':', ',')
+    params = tuple(float(arg) for arg in args.split(',') if arg.strip())
+
+    if name == 'piecewise':
+        xs = params[0::2]
+        if len(params) < 4 or len(params) % 2 or list(xs) != sorted(xs):
+            raise ValueError('piecewise needs at least two x:y points '
+                             'with increasing x')
+    return name, params
+
+
+def normalize(values, effect, bounds=None, method='linear', params=()):
+    """ scale values to 0..1 with a value function, reversed when effect
+    is "-"
+
+    For the linear value function any other effect leaves the values
+    unscaled, other value functions treat it like "+".
+
+    :param bounds: Known (min, max) of values, skips the reductions.
+    :type bounds: tuple
+
+    :param method: Name of a registered value function.
+    :type method: str
+
+    :param params: Parameters of the value function, see parse_method.
+    :type params: tuple
+    """
+    if method == 'linear' and effect not in ("+", "-"):
+        return values
+
+    if len(values) == 0:
+        return values.astype(np.float64)
+
+    scaled = VALUE_FUNCTIONS[method](values, params, bounds)
+    if effect == "-":
+        return 1.0 - scaled
+    return scaled
+
+
+def _min_max(values, bounds):
+    if bounds is None:
+        return values.min(), values.max()
+    return bounds
+
+
+def _linear(values, params, bounds):
+    """ min/max scaling. If every value is the same the criterion cannot
+    discriminate and all rows score 1 """
+    min_value, max_value = _min_max(values, bounds)
+    span = max_value - min_value
+    if span == 0:
+        return np.ones(len(values), dtype=np.float64)
+    return (values - min_value) / span
+
+
+def _zscore(values, params, bounds):
+    """ standard score clipped to +-3 standard deviations """
+    std = values.std()
+    if std == 0:
+        return np.ones(len(values), dtype=np.float64)
+    z = (values - values.mean()) / std
+    return (np.clip(z, -3.0, 3.0) + 3.0) / 6.0
+
+
+def _percentile(values, params, bounds):
+    """ share of the other values that are lower, ties averaged """
+    n = len(values)
+    if n == 1:
+        return np.ones(1, dtype=np.float64)
+    return (n - rank_descending(values)) / (n - 1)
+
+
+def _piecewise(values, params, bounds):
+    """ linear interpolation between x:y points, flat outside them """
+    return np.interp(values, params[0::2], params[1::2])
+
+
+def _sigmoid(values, params, bounds):
+    """ logistic curve, by default centred on the middle of the value
+    range and reaching about 0.99 at its ends """
+    min_value, max_value = _min_max(values, bounds)
+    span = max_value - min_value
+    midpoint = params[0] if len(params) > 0 else (min_value + max_value) / 2
+    steepness = params[1] if len(params) > 1 else 10.0 / (span or 1.0)
+    with np.errstate(over='ignore'):
+        return 1.0 / (1.0 + np.exp(-steepness * (values - midpoint)))
+
+
+# value functions selectable per criterion. Each takes the values, the
+# parsed parameters and optional known (min, max) and returns an array of
+# the same length with 0 as worst and 1 as best
+VALUE_FUNCTIONS = {
+    'linear': _linear,
+    'zscore': _zscore,
+    'percentile': _percentile,
+    'piecewise': _piecewise,
+    'sigmoid': _sigmoid,
+}
+
+# value functions that work row by row once (min, max) is known, so they
+# can be applied to row chunks of a column, see parallel.py
+ELEMENTWISE = {'linear', 'piecewise', 'sigmoid'}
+
+
+def _dot(matrix, weights):
+    """ matrix @ weights, accumulated one criterion at a time
+
+    BLAS may sum a row's products in a different order depending on the
+    number of rows, so a row's result could change with the chunking.
+    Summing whole columns keeps it the same for any block of rows.
+    """
+    result = np.zeros(len(matrix), dtype=np.float64)
+    product = np.empty(len(matrix), dtype=np.float64)
+    for i, weight in enumerate(weights):
+        np.multiply(matrix[:, i], weight, out=product)
+        result += product
+    return result
+
+
+def _weighted_sum(matrix, weights):
+    return _dot(matrix, weights)
+
+
+def _weighted_product(matrix, weights):
+    """ product of the values raised to their share of the total weight,
+    scaled by the total weight like the weighted sum """
+    total = weights.sum()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logs = np.log(matrix)
+    # a zero weight ignores the criterion even where its value is 0
+    logs[:, weights == 0] = 0.0
+    return total * np.exp(_dot(logs, weights / total))
+
+
+def _owa(matrix, weights):
+    """ ordered weighted average, the weights in criteria order are
+    applied to each row's values sorted from best to worst """
+    ordered = -np.sort(-matrix, axis=1)
+    return _dot(ordered, weights)
+
+
+# aggregations of the normalized criteria matrix into a score. Each takes
+# a (rows x criteria) matrix and the weights in criteria order
+AGGREGATIONS = {
+    'weighted_sum': _weighted_sum,
+    'weighted_product': _weighted_product,
+    'owa': _owa,
+}
+
+
+def rank_descending(values):
+    """ rank values with the highest first, ties get their average rank
+
+    Matches pandas.Series.rank(ascending=False) with the default
+    "average" method.
+    """
+    n = len(values)
+    ranks = np.empty(n, dtype=np.float64)
+    if n == 0:
+        return ranks
+
+    # ties share one averaged rank, so the sort need not be stable
+    order = np.argsort(-values)
+    ordered = values[order]
+
+    # positions where a new group of equal values starts
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(ordered)) + 1))
+    ends = np.concatenate((starts[1:], [n]))
+
+    ranks[order] = np.repeat((starts + ends + 1) / 2.0, ends - starts)
+    return ranks
+
+
+def normalize_columns(columns, criteria, mask, stats=None, cache=None):
+    """ normalized criteria matrix of the rows selected by mask
+
+    :param stats: Mapping of field name to known (min, max) of the masked
+        rows, see score_columns.
+    :type stats: dict
+
+    :param cache: Normalized columns of an earlier call, keyed by
+        normalization_key. Matching columns are reused instead of being
+        normalized again, and the cache is left holding exactly the
+        columns of this call.
+    :type cache: dict
+
+    :returns: Array of shape (rows, criteria) in criteria order.
+    :rtype: numpy.ndarray
+    """
+    if stats is None:
+        stats = {}
+
+    matrix = np.empty((int(mask.sum()), len(criteria)), order='F')
+    normalized = {}
+    for i, (field, spec) in enumerate(criteria.items()):
+        key = normalization_key(field, criteria)
+        column = None if cache is None else cache.get(key)
+        if column is None:
+            values = np.asarray(columns[field], dtype=np.float64)[mask]
+            method, params = parse_method(spec.get('method'))
+            column = normalize(values, spec['effect'], stats.get(field),
+                               method, params)
+        normalized[key] = matrix[:, i] = column
+
+    if cache is not None:
+        cache.clear()
+        cache.update(normalized)
+    return matrix
+
+
+def normalization_key(field, criteria):
+    """ everything a normalized column depends on, apart from the data
+
+    That is the criterion's own effect and value function plus the bounds
+    and missing value policies of every criterion, which decide the rows
+    it is normalized over and their values. The weights are left out, so
+    a weight-only change reuses every column.
+    """
+    spec = criteria[field]
+    bounds = tuple((name, other['lower'], other['upper'],
+                    other.get('missing', 'exclude'))
+                   for name, other in sorted(criteria.items()))
+    return (field, spec['effect'], spec.get('method') or 'linear', bounds)
+
+
+def criteria_weights(criteria):
+    """ weights as a float64 array in criteria order """
+    return np.array([spec['weight'] for spec in criteria.values()],
+                    dtype=np.float64)
+
+
+def aggregate(matrix, weights, aggregation='weighted_sum'):
+    """ combine a normalized criteria matrix into one score per row """
+    if aggregation not in AGGREGATIONS:
+        raise ValueError('Unknown aggregation "{}"'.format(aggregation))
+    return AGGREGATIONS[aggregation](matrix, weights)
+
+
+def top_k_rows(score, k):
+    """ positions of the k highest scores, best first
+
+    Uses a partial selection, so only the k selected scores are sorted.
+    Among scores tied at the k-th place an arbitrary subset is kept.
+    """
+    if k >= len(score):
+        return np.argsort(-score)
+    selected = np.argpartition(-score, k - 1)[:k]
+    return selected[np.argsort(-score[selected])]
+
+
+def score_columns(columns, criteria, stats=None,
+                  aggregation='weighted_sum', top_k=None, cache=None,
+                  executor=None, chunks=None, details=None):
+    """ normalize, weight and rank a column block against the criteria
+
+    Missing values are imputed by each criterion's policy first, see
+    fill_missing. Rows are then filtered with a single combined mask, so
+    each criterion is normalized over the rows that pass all bounds.
+
+    :param columns: Mapping of field name to a float64 array.
+    :type columns: dict
+
+    :param criteria: Criteria spec, see criteria_mask. A criterion may
+        also name its value function under "method", see parse_method,
+        and its missing value policy under "missing".
+    :type criteria: dict
+
+    :param stats: Optional mapping of field name to the (min, max) of the
+        whole column, e.g. from a statistics cache. Used instead of
+        scanning the column when no row is filtered out.
+    :type stats: dict
+
+    :param aggregation: Name of a registered aggregation.
+    :type aggregation: str
+
+    :param top_k: Keep only the k best rows in the mask. Their ranks are
+        computed without sorting the full score column.
+    :type top_k: int
+
+    :param cache: Normalized columns to reuse, see normalize_columns.
+    :type cache: dict
+
+    :param executor: Pool to normalize and aggregate row chunks on, see
+        parallel.create_executor. The result equals a serial run.
+    :type executor: concurrent.futures.Executor
+
+    :param chunks: Number of row chunks for the executor.
+    :type chunks: int
+
+    :param details: Receives the intermediate "columns" after imputation,
+        the "imputed" rows, the "mask" of rows within bounds and the
+        normalized "matrix" of those rows.
+    :type details: dict
+
+    :returns: Mask, score and rank arrays, one entry per input row.
+    :rtype: ScoreResult
+    """
+    columns, imputed = fill_missing(columns, criteria)
+    mask = criteria_mask(columns, criteria)
+
+    # cached column bounds only describe the filtered rows if none is lost
+    if stats is not None and not mask.all():
+        stats = None
+
+    if executor is None:
+        matrix = normalize_columns(columns, criteria, mask, stats, cache)
+        aggregate_score = aggregate(matrix, criteria_weights(criteria),
+                                    aggregation)
+    else:
+        # parallel builds on this module
+        from .parallel import aggregate_parallel, normalize_columns_parallel
+
+        matrix = normalize_columns_parallel(columns, criteria, mask, stats,
+                                            cache, executor, chunks)
+        aggregate_score = aggregate_parallel(matrix,
+                                             criteria_weights(criteria),
+                                             aggregation, executor, chunks)
+
+    if details is not None:
+        details.update(columns=columns, imputed=imputed, mask=mask,
+                       matrix=matrix)
+    return rank_scores(mask, aggregate_score, top_k)
+
+
+def rank_scores(mask, aggregate_score, top_k=None):
+    """ spread the scores of the masked rows over all rows and rank them
+
+    :param mask: Rows that were scored.
+    :type mask: numpy.ndarray
+
+    :param aggregate_score: One score per True entry of mask.
+    :type aggregate_score: numpy.ndarray
+
+    :param top_k: Keep only the k best rows, see score_columns.
+    :type top_k: int
+
+    :rtype: ScoreResult
+    """
+    n = len(mask)
+    rows = np.flatnonzero(mask)
+    if top_k:
+        selected = top_k_rows(aggregate_score, top_k)
+        rows = rows[selected]
+        aggregate_score = aggregate_score[selected]
+        mask = np.zeros(n, dtype=bool)
+        mask[rows] = True
+
+    score = np.full(n, np.nan)
+    rank = np.full(n, np.nan)
+    score[rows] = aggregate_score
+    rank[rows] = rank_descending(aggregate_score)
+
+    return ScoreResult(mask, score, rank)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ Monte Carlo weight sensitivity. Plain NumPy like scoring.py: samples
+ weight vectors around the criteria weights, scores all of them and
+ summarises how stable each row's rank is.
+"""
+
+import numpy as np
+
+from .scoring import aggregate, rank_descending
+
+# memory a block of sample scores may take, in bytes
+BLOCK_BYTES = 64 * 2 ** 20
+
+
+def sample_weights(weights, samples, spread=0.2, seed=0):
+    """ weight vectors scattered around weights
+
+    Each weight is scaled by a factor drawn uniformly from 1 +- spread,
+    then every vector is rescaled to the total of weights, so scores stay
+    comparable. A fixed seed makes reports reproducible.
+
+    :param weights: Weights in criteria order.
+    :type weights: numpy.ndarray
+
+    :returns: Array of shape (samples, criteria).
+    :rtype: numpy.ndarray
+    """
+    rng = np.random.default_rng(seed)
+    factors = rng.uniform(1.0 - spread, 1.0 + spread,
+                          (samples, len(weights)))
+    sampled = np.clip(factors, 0.0, None) * weights
+    totals = sampled.sum(axis=1, keepdims=True)
+    totals[totals == 0] = 1.0
+    return sampled * (weights.sum() / totals)
+
+
+def rank_statistics(matrix, samples, aggregation='weighted_sum', top_k=10,
+                    feedback=None):
+    """ mean and standard deviation of each row's rank over weight
+    samples, and the share of samples ranking it in the top K
+
+    Samples are scored in blocks sized to BLOCK_BYTES. For weighted_sum
+    and owa a block is one matrix product of (rows x criteria) by
+    (criteria x block). Each sample is ranked over all rows, so blocks
+    split the samples rather than the rows.
+
+    :param matrix: Normalized criteria matrix, see normalize_columns.
+    :type matrix: numpy.ndarray
+
+    :param samples: Weight vectors, see sample_weights.
+    :type samples: numpy.ndarray
+
+    :param feedback: Receives progress and is polled for cancellation,
+        e.g. a QgsFeedback.
+
+    :returns: mean_rank, rank_std and pct_top_k arrays with one entry per
+        row, or None if cancelled.
+    :rtype: tuple
+    """
+    n = len(matrix)
+    rank_sum = np.zeros(n)
+    rank_squares = np.zeros(n)
+    top_count = np.zeros(n)
+
+    if aggregation == 'owa':
+        # the ordered weighted average is linear once rows are sorted
+        matrix = -np.sort(-matrix, axis=1)
+
+    block = max(1, BLOCK_BYTES // max(8 * n, 1))
+    for start in range(0, len(samples), block):
+        scores = _block_scores(matrix, samples[start:start + block],
+                               aggregation)
+        for column in scores.T:
+            rank = rank_descending(column)
+            rank_sum += rank
+            rank_squares += rank * rank
+            top_count += rank <= top_k
+
+        if feedback is not None:
+            if feedback.isCanceled():
+                return None
+            feedback.setProgress(100 * min(start + block, len(samples))
+                                 / len(samples))
+
+    count = max(len(samples), 1)
+    mean_rank = rank_sum / count
+    variance = np.clip(rank_squares / count - mean_rank ** 2, 0.0, None)
+    return mean_rank, np.sqrt(variance), 100.0 * top_count / count
+
+
+def _block_scores(matrix, block, aggregation):
+    """ scores of every row for a block of weight vectors, one column per
+    sample """
+    if aggregation in ('weighted_sum', 'owa'):
+        return matrix @ block.T
+    # not linear in the weights, aggregate one sample at a time
+    return np.column_stack([aggregate(matrix, weights, aggregation)
+                            for weights in block])
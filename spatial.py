@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+
+ Spatial criteria, derived from the geometry of every analysed feature
+ and a second layer instead of read from an attribute.
+
+ A criterion named distance(<layer>) is the distance to the nearest
+ feature of <layer>, in map units of the analysed layer. One named
+ overlap(<layer>) is the share of the feature covered by the polygons of
+ <layer> in percent, by area for polygons, by length for lines and 0 or
+ 100 for points. <layer> is a layer name or id, in Processing also a
+ file path.
+"""
+
+import re
+
+import numpy as np
+
+from qgis.core import (QgsFeatureRequest, QgsGeometry,
+                       QgsProject, QgsSpatialIndex, QgsVectorLayer,
+                       QgsVectorLayerFeatureSource, QgsWkbTypes)
+
+from .extraction import feature_batches, map_ranges
+
+# bounds a new spatial criterion starts with in the criteria table
+DEFAULT_BOUNDS = {
+    'distance': (0.0, float('inf')),
+    'overlap': (0.0, 100.0),
+}
+
+_SPATIAL = re.compile(r'^\s*(distance|overlap)\s*\((.+)\)\s*$')
+
+
+def parse_spatial(name):
+    """ kind and layer reference of a spatial criterion name
+
+    :returns: (kind, reference), or None for an attribute field.
+    :rtype: tuple
+    """
+    match = _SPATIAL.match(name)
+    if match is None:
+        return None
+    return match.group(1), match.group(2).strip()
+
+
+def spatial_name(kind, layer):
+    """ criterion name of a spatial criterion against layer, referring
+    to it by name unless another project layer has the same name """
+    reference = layer.name()
+    if len(QgsProject.instance().mapLayersByName(reference)) > 1:
+        reference = layer.id()
+    return '{}({})'.format(kind, reference)
+
+
+def resolve_layer(reference, context=None):
+    """ vector layer with geometry a spatial criterion refers to, or None
+
+    A name shared by several layers resolves to None rather than to any
+    one of them.
+
+    :param reference: Layer id or name, see parse_spatial.
+    :type reference: str
+
+    :param context: Processing context, which also resolves file paths.
+        Layers of the current project are searched when omitted.
+    :type context: QgsProcessingContext
+    """
+    project = QgsProject.instance() if context is None else context.project()
+    if project is not None and len(project.mapLayersByName(reference)) > 1:
+        return None
+
+    if context is not None:
+        from qgis.core import QgsProcessingUtils
+
+        layer = QgsProcessingUtils.mapLayerFromString(reference, context)
+    else:
+        layer = project.mapLayer(reference)
+        if layer is None:
+            layers = project.mapLayersByName(reference)
+            layer = layers[0] if layers else None
+
+    if not isinstance(layer, QgsVectorLayer) or not layer.isSpatial():
+        return None
+    return layer
+
+
+def spatial_problem(name, layer):
+    """ why a spatial criterion cannot be computed against layer, or None
+
+    :param layer: Layer resolved from the criterion name, None if it was
+        not found.
+    :type layer: QgsVectorLayer
+    """
+    kind, reference = parse_spatial(name)
+    if layer is None:
+        return 'Layer "{}" of "{}" is not a vector layer with ' \
+               'geometry, or several layers have that name'.format(
+                   reference, name)
+    if (kind == 'overlap'
+            and layer.geometryType() != QgsWkbTypes.PolygonGeometry):
+        return 'Layer "{}" of "{}" is not a polygon layer'.format(
+            reference, name)
+    return None
+
+
+def spatial_criteria(criteria, crs, transform_context, context=None,
+                     cache=None, layer=None):
+    """ a SpatialCriterion for every spatial criterion of criteria
+
+    Must be called on the main thread.
+
+    :param crs: CRS of the analysed features.
+    :type crs: QgsCoordinateReferenceSystem
+
+    :param transform_context: Transforms the second layers into crs.
+    :type transform_context: QgsCoordinateTransformContext
+
+    :param context: Processing context to resolve layers with, see
+        resolve_layer.
+    :type context: QgsProcessingContext
+
+    :param cache: Values computed by earlier runs on layer.
+    :type cache: SpatialCriteriaCache
+
+    :param layer: Analysed layer, needed to look values up in cache.
+    :type layer: QgsVectorLayer
+
+    :returns: Mapping of criterion name to SpatialCriterion.
+    :rtype: dict
+
+    :raises ValueError: If a second layer cannot be used.
+    """
+    spatial = {}
+    for name in criteria:
+        parsed = parse_spatial(name)
+        if parsed is None:
+            continue
+
+        kind, reference = parsed
+        other = resolve_layer(reference, context)
+        problem = spatial_problem(name, other)
+        if problem is not None:
+            raise ValueError(problem)
+
+        key = cached = None
+        if cache is not None and layer is not None:
+            key = cache.key(layer, other, kind)
+            cached = cache.lookup(key)
+        spatial[name] = SpatialCriterion(kind, other, crs, transform_context,
+                                         cached, key)
+    return spatial
+
+
+class SpatialCriterion:
+    """ one spatial criterion against a second layer
+
+    The second layer is read through a QgsVectorLayerFeatureSource taken
+    in the constructor, which must run on the main thread. Its features
+    are bulk loaded into a QgsSpatialIndex holding their geometries in
+    the analysed layer's CRS, so the nearest or overlapping features of
+    each analysed feature are found without another read. The index
+    serializes its own queries, chunks of features can use it from
+    several threads.
+    """
+
+    def __init__(self, kind, layer, crs, transform_context, cached=None,
+                 key=None):
+        """Constructor.
+
+        :param kind: distance or overlap, see parse_spatial.
+        :type kind: str
+
+        :param layer: Second layer.
+        :type layer: QgsVectorLayer
+
+        :param crs: CRS of the analysed features.
+        :type crs: QgsCoordinateReferenceSystem
+
+        :param transform_context: Transforms layer into crs.
+        :type transform_context: QgsCoordinateTransformContext
+
+        :param cached: Sorted feature ids and their values from an earlier
+            run, see SpatialCriteriaCache.
+        :type cached: tuple
+
+        :param key: Key of the values in a SpatialCriteriaCache.
+        :type key: tuple
+        """
+        self.kind = kind
+        self.source = QgsVectorLayerFeatureSource(layer)
+        self.crs = crs
+        self.transformContext = transform_context
+        self.cached = cached
+        self.key = key
+        self.index = None
+
+
+    def cachedValues(self, ids):
+        """ values of ids from the cached values, or None unless all of
+        them are cached """
+        if self.cached is None:
+            return None
+
+        cached_ids, values = self.cached
+        if len(cached_ids) == 0:
+            return values if len(ids) == 0 else None
+        positions = np.minimum(np.searchsorted(cached_ids, ids),
+                               len(cached_ids) - 1)
+        if not np.array_equal(cached_ids[positions], ids):
+            return None
+        return values[positions]
+
+
+    def buildIndex(self, feedback=None):
+        """ index the geometries of the second layer, once """
+        if self.index is not None:
+            return
+
+        request = QgsFeatureRequest().setNoAttributes()
+        request.setDestinationCrs(self.crs, self.transformContext)
+        self.index = QgsSpatialIndex(
+            self.source.getFeatures(request), feedback,
+            QgsSpatialIndex.FlagStoreFeatureGeometries)
+
+
+    def value(self, geometry):
+        """ criterion value of one analysed geometry, NaN when it has no
+        geometry or there is nothing to measure the distance to """
+        if geometry.isNull() or geometry.isEmpty():
+            return np.nan
+        if self.kind == 'distance':
+            return self.distance(geometry)
+        return self.overlap(geometry)
+
+
+    def distance(self, geometry):
+        """ distance to the nearest feature of the second layer """
+        nearest = self.index.nearestNeighbor(geometry, 1)
+        if not nearest:
+            return np.nan
+        return min(geometry.distance(self.index.geometry(fid))
+                   for fid in nearest)
+
+
+    def overlap(self, geometry):
+        """ percentage of geometry covered by the second layer """
+        engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+        engine.prepareGeometry()
+        parts = [self.index.geometry(fid)
+                 for fid in self.index.intersects(geometry.boundingBox())]
+        parts = [part for part in parts if engine.intersects(part.constGet())]
+        if not parts:
+            return 0.0
+
+        geometry_type = geometry.type()
+        if geometry_type == QgsWkbTypes.PointGeometry:
+            return 100.0
+
+        covered = geometry.intersection(QgsGeometry.unaryUnion(parts))
+        if geometry_type == QgsWkbTypes.PolygonGeometry:
+            total, part = geometry.area(), covered.area()
+        else:
+            total, part = geometry.length(), covered.length()
+        if total <= 0:
+            return np.nan
+        return min(100.0 * part / total, 100.0)
+
+
+def spatial_columns(sources, ids, criteria, executor=None, feedback=None):
+    """ values of spatial criteria for features of the analysed layer
+
+    Criteria with every value cached are not computed again. The others
+    share one read of the analysed geometries, split over id ranges read
+    concurrently like extraction.extract_columns_parallel when an
+    executor is given.
+
+    :param sources: One independent feature source of the analysed layer
+        per range, only the first is used without an executor.
+    :type sources: list
+
+    :param ids: Feature ids to compute the values of.
+    :type ids: numpy.ndarray
+
+    :param criteria: Mapping of criterion name to SpatialCriterion.
+    :type criteria: dict
+
+    :param executor: Thread pool, see parallel.create_executor.
+    :type executor: concurrent.futures.ThreadPoolExecutor
+
+    :param feedback: Receives progress and is polled for cancellation.
+        Values not computed before cancelling are NaN.
+    :type feedback: QgsFeedback
+
+    :returns: Mapping of criterion name to a float64 array in the order
+        of ids.
+    :rtype: dict
+    """
+    columns = {}
+    pending = {}
+    for name, criterion in criteria.items():
+        values = criterion.cachedValues(ids)
+        if values is None:
+            pending[name] = criterion
+        else:
+            columns[name] = values
+    if not pending:
+        return columns
+
+    for criterion in pending.values():
+        criterion.buildIndex(feedback)
+
+    if executor is None:
+        columns.update(_compute_chunk(sources[0], ids, pending, feedback))
+        return columns
+
+    parts = np.array_split(ids, len(sources))
+    results = map_ranges(executor, _compute_chunk,
+                         [(source, part, pending)
+                          for source, part in zip(sources, parts)],
+                         feedback)
+    for name in pending:
+        columns[name] = np.concatenate([result[name] for result in results])
+    return columns
+
+
+def _compute_chunk(source, ids, criteria, feedback=None):
+    """ values of criteria for one range of ids, in the order of ids """
+    columns = {name: np.full(len(ids), np.nan) for name in criteria}
+    total = max(len(ids), 1)
+
+    request = QgsFeatureRequest().setNoAttributes()
+
+    done = 0
+    for batch, rows in feature_batches(source, request, ids,
+                                       filter_ids=True):
+        for feat, row in zip(batch, rows.tolist()):
+            geometry = feat.geometry()
+            for name, criterion in criteria.items():
+                columns[name][row] = criterion.value(geometry)
+        done += len(batch)
+
+        if feedback is not None:
+            if feedback.isCanceled():
+                break
+            feedback.setProgress(100 * done / total)
+    return columns
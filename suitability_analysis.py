@@ -10,7 +10,6 @@
  ***************************************************************************/
 """
 
-from lib2to3.pgen2.pgen import DFAState
 from qgis.PyQt.QtCore import *
 from qgis.PyQt.QtGui import *
 from qgis.PyQt.QtWidgets import *
@@ -21,13 +20,17 @@ from qgis.utils import *
 
 # Initialize Qt resources from file resources.py
 from .resources import *
-# Import the code for the dialog
-from .suitability_analysis_dialog import SuitabilityAnalysisDialog
+# The dialog and the analysis modules, which pull in numpy, are imported
+# on first use so they do not slow down QGIS startup
+from .profiling import StageProfiler
+from .processing_provider import SuitabilityProvider
+from .field_stats import FieldStatisticsCache, SpatialCriteriaCache
 import os.path
-
-import numpy as np
-import pandas as pd
 import time
+from functools import partial
+
+# seconds a live weight preview may take before it is logged as slow
+PREVIEW_BUDGET = 0.1
 
 
 class SuitabilityAnalysis:
@@ -59,6 +62,13 @@ class SuitabilityAnalysis:
 
         # Declare instance attributes
         self.actions = []
+        self.tasks = []
+        self.statistics = FieldStatisticsCache()
+        self.spatialValues = SpatialCriteriaCache(self.statistics)
+        self.lastRun = None
+        self.preview = None
+        self.previewStart = None
+        self.fieldSchema = None
         self.menu = self.tr(u'&Suitability Analysis')
 
         # Check if plugin was started the first time in current QGIS session
@@ -155,9 +165,17 @@ class SuitabilityAnalysis:
 
         return action
 
+    def initProcessing(self):
+        """Register the Processing provider for batch and model runs."""
+        self.provider = SuitabilityProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
+
+
     def initGui(self):
         """Create the menu entries and toolbar icons inside the QGIS GUI."""
 
+        self.initProcessing()
+
         icon_path = ':/plugins/suitability_analysis/icon.png'
         self.add_action(
             icon_path,
@@ -179,19 +197,28 @@ class SuitabilityAnalysis:
                 action)
             self.iface.removeToolBarIcon(action)
 
+        for task in self.tasks:
+            task.cancel()
 
-    def validateWeights(self):
-        """ checks that input weights sum to 100 """
+        QgsApplication.processingRegistry().removeProvider(self.provider)
+
+        if self.preview is not None:
+            self.togglePreview(False)
 
-        weight_sum = 0
-        for row in range(self.dlg.fieldTable.rowCount()):
-            weight_sum += int(float(self.dlg.fieldTable.item(row,3).text()))
 
-        if round(weight_sum) == 100:
-            pass
-        else: 
+    def validateWeights(self, criteria):
+        """ checks criteria before any heavy stage starts, e.g. that the
+        fields exist and weights sum to 100
+
+        :param criteria: Criteria as read by readTable or a profile.
+        :type criteria: dict
+        """
+        from .profiles import validate_criteria
+
+        problems = validate_criteria(criteria, self.inputLayer.fields())
+        if problems:
             iface.messageBar().pushMessage("Input error",
-                "Field weights must sum to 100",
+                "; ".join(problems),
                 level = Qgis.Critical,
                 duration = 10)
             return False
@@ -202,221 +229,690 @@ class SuitabilityAnalysis:
     def updateFields(self):
         """ reload the available fields when layer is changed """
 
-        self.dlg.fieldSelector.clear()
         self.dlg.fieldTable.clearContents()
         self.dlg.fieldTable.setRowCount(0)
-        self.dlg.fieldSelector.addItems([str(x.name()) for x in
-            self.dlg.layerInput.currentLayer().fields() if x.isNumeric()])
+        self.fieldSchema = None
+        self.refreshFields()
+
+
+    def refreshFields(self):
+        """ list the criteria of the current layer in the field selector
+
+        The list is only rebuilt when the layer, its fields or the layers
+        of the project changed since it was filled, so reopening the
+        dialog keeps the selection and the criteria table.
+        """
+        layer = self.dlg.layerInput.currentLayer()
+        names = [] if layer is None else self.criteriaNames(layer)
+        schema = (None if layer is None else layer.id(), names)
+        if schema == self.fieldSchema:
+            return
+
+        self.fieldSchema = schema
+        self.dlg.fieldSelector.clear()
+        self.dlg.fieldSelector.addItems(names)
+
+
+    def criteriaNames(self, layer):
+        """ numeric fields of layer followed by the spatial criteria it
+        can be measured with against the other layers of the project """
+        from .spatial import spatial_name
+
+        names = [str(x.name()) for x in layer.fields() if x.isNumeric()]
+        if not layer.isSpatial():
+            return names
+
+        others = sorted((other for other in
+                         QgsProject.instance().mapLayers().values()
+                         if isinstance(other, QgsVectorLayer)
+                         and other.isSpatial() and other.id() != layer.id()),
+                        key=lambda other: other.name())
+        for other in others:
+            names.append(spatial_name('distance', other))
+            if other.geometryType() == QgsWkbTypes.PolygonGeometry:
+                names.append(spatial_name('overlap', other))
+        return names
 
 
     def populateTable(self):
         """ populate QTableWidget that shows the fields to be analysed. 
         Called after user clicks the "Add selected fields" button"""
 
+        from .spatial import DEFAULT_BOUNDS, parse_spatial
+
         selected_fields = self.dlg.fieldSelector.selectedItems()
-        flags = Qt.ItemIsEnabled
         if len(selected_fields) > 0:
             self.dlg.fieldTable.clearContents()
             self.dlg.fieldTable.setRowCount(len(selected_fields))
 
             layer = self.dlg.layerInput.currentLayer()
 
+            names = [str(i.text()) for i in selected_fields]
+            spatial = {name: parse_spatial(name) for name in names
+                       if parse_spatial(name) is not None}
+
+            # one pass over the layer for every field not cached yet,
+            # spatial criteria start from bounds that keep every feature
+            stats = self.statistics.statistics(layer,
+                [name for name in names if name not in spatial])
+            stats.update({name: DEFAULT_BOUNDS[kind]
+                          for name, (kind, _) in spatial.items()})
+
             for current, i in enumerate(selected_fields):
                 field_name = str(i.text())
-                field_index = layer.fields().lookupField(field_name)
-                maxValue = layer.maximumValue(field_index)
-                minValue = layer.minimumValue(field_index)
-                
-                field_name = QTableWidgetItem( field_name )
-                lower = QTableWidgetItem(str( minValue ))
-                upper = QTableWidgetItem(str( maxValue ))
-                weight = QTableWidgetItem(str( round( 100 / len( selected_fields ), 2 )))
-                effect = QTableWidgetItem( "+" )
-
-                lower.setTextAlignment(Qt.AlignHCenter)
-                upper.setTextAlignment(Qt.AlignHCenter)
-                weight.setTextAlignment(Qt.AlignHCenter)
-                effect.setTextAlignment(Qt.AlignHCenter)
-
-                field_name.setFlags(flags)
-                self.dlg.fieldTable.setItem(current, 0, field_name)
-                self.dlg.fieldTable.setItem(current, 1, lower)
-                self.dlg.fieldTable.setItem(current, 2, upper)
-                self.dlg.fieldTable.setItem(current, 3, weight)
-                self.dlg.fieldTable.setItem(current, 4, effect)
+                minValue, maxValue = stats[field_name]
+                self.setCriteriaRow(current, field_name, minValue, maxValue,
+                                    round( 100 / len( selected_fields ), 2 ),
+                                    "+", "linear")
 
 
-    def fetchCriteria(self):
-        """ get suitability criteria from input form """
-        self.criteria = {}
+    def setCriteriaRow(self, row, field_name, lower, upper, weight, effect,
+                       method):
+        """ fill one row of the fields table """
+        flags = Qt.ItemIsEnabled
+
+        field_name = QTableWidgetItem( field_name )
+        lower = QTableWidgetItem('' if lower is None else str( lower ))
+        upper = QTableWidgetItem('' if upper is None else str( upper ))
+        weight = QTableWidgetItem(str( weight ))
+        effect = QTableWidgetItem( effect )
+        method = QTableWidgetItem( method )
+
+        lower.setTextAlignment(Qt.AlignHCenter)
+        upper.setTextAlignment(Qt.AlignHCenter)
+        weight.setTextAlignment(Qt.AlignHCenter)
+        effect.setTextAlignment(Qt.AlignHCenter)
+        method.setTextAlignment(Qt.AlignHCenter)
+
+        field_name.setFlags(flags)
+        self.dlg.fieldTable.setItem(row, 0, field_name)
+        self.dlg.fieldTable.setItem(row, 1, lower)
+        self.dlg.fieldTable.setItem(row, 2, upper)
+        self.dlg.fieldTable.setItem(row, 3, weight)
+        self.dlg.fieldTable.setItem(row, 4, effect)
+        self.dlg.fieldTable.setItem(row, 5, method)
+
 
+    def readTable(self):
+        """ criteria as entered in the fields table, weights unrounded
+
+        :raises ValueError: If a bound or weight is not a number.
+        """
+        criteria = {}
         for row in range(self.dlg.fieldTable.rowCount()):
             field_name = self.dlg.fieldTable.item(row,0).text()
 
-            self.criteria[field_name] = {
+            criteria[field_name] = {
                 "lower": float(self.dlg.fieldTable.item(row,1).text()),
                 "upper": float(self.dlg.fieldTable.item(row,2).text()),
-                "weight": int(float(self.dlg.fieldTable.item(row,3).text())),
-                "effect": self.dlg.fieldTable.item(row,4).text()
+                "weight": float(self.dlg.fieldTable.item(row,3).text()),
+                "effect": self.dlg.fieldTable.item(row,4).text(),
+                "method": self.dlg.fieldTable.item(row,5).text()
             }
+        return criteria
 
 
-    def createOutputLayer(self):
-        """ create output memory layer """
-        # get input layer information 
-        layer = self.dlg.layerInput.currentLayer()
-        layer_type = {'0':'Point', '1':'LineString', '2':'Polygon'}
-        layer_crs = layer.crs().authid()
-
-        # duplicated layer into memory
-        mem_layer = QgsVectorLayer(layer_type[str(layer.geometryType())] 
-                        + "?crs=" + str(layer_crs), 
-                        "suitability_output", "memory")
-        mem_layer_data = mem_layer.dataProvider()
-
-        # copy attributes from input layer to memory layer
-        attr_fields = layer.dataProvider().fields().toList()
-        mem_layer_data.addAttributes(attr_fields)
-        mem_layer.updateFields()
-
-        # copy features from input layer to memory layer
-        feats = [feat for feat in layer.getFeatures()]
-        mem_layer_data.addFeatures(feats)
-
-        self.outputLayer = mem_layer
-
-
-    def pandify(self):
-        """ create pandas dataframe for numerical processing """
-        # list columns to include in the dataframe
-        cols = [f for f in self.criteria] 
-        cols.append('FID')
-
-        # generator to yield one row at a time
-        datagen = ([f[col] for col in cols] for f in self.outputLayer.getFeatures())
-
-        # create dataframe
-        self.df = pd.DataFrame.from_records(data=datagen, columns=cols)
-
-
-    def calculations(self):
-        """ normalize data & calcuate score and rank """
-        df = self.df
-        criteria = self.criteria
-
-        aggregate_score = 0
-        for field in criteria: 
-            lower = criteria[field]['lower']
-            upper = criteria[field]['upper']
-            weight = criteria[field]['weight']
-            effect = criteria[field]['effect']
-
-            # trim df by lower/upper bounds
-            df = df[df[field] >= lower]
-            df = df[df[field] <= upper]
-            
-            # normalize data
-            max_value = df[field].max()
-            min_value = df[field].min()
-            if effect == "+":
-                df[field] = (df[field] - min_value) / (max_value - min_value)
-            elif effect == "-":
-                df[field] = (max_value - df[field]) / (max_value - min_value)
-            else:
-                pass
-
-            # calculate weighted score
-            weighted_score = df[field] * weight
-            aggregate_score += weighted_score
-
-        df['score'] = aggregate_score
-        df['rank'] = df['score'].rank(ascending=False)
-
-        self.df = df
-
-
-    def updateSHP(self):
-        """ merge dataframe back into memory layer """
-
-        vpr = self.outputLayer.dataProvider()            
-
-        with edit(self.outputLayer):
-            vpr.addAttributes([QgsField('score', QVariant.Double)])
-            vpr.addAttributes([QgsField('rank', QVariant.Double)])
-            self.outputLayer.updateFields()
-
-            feat_list = [( feat.attribute(feat.fieldNameIndex('FID') ), 
-                            feat.id()) for feat in self.outputLayer.getFeatures()]
-
-            score_field = vpr.fieldNameIndex('score')
-            rank_field = vpr.fieldNameIndex('rank')
-
-            for feat in feat_list:
-                try:
-                    fid = feat[0]
-                    score_value = float(self.df.loc[self.df['FID']==fid]['score'])
-                    rank_value = float(self.df.loc[self.df['FID']==fid]['rank'])
-                    self.outputLayer.changeAttributeValue(feat[1], score_field, score_value)
-                    self.outputLayer.changeAttributeValue(feat[1], rank_field, rank_value)
-                except:
-                    vpr.deleteFeatures([ fid ])
-                    #self.outputLayer.changeAttributeValue(feat[1], score_field, 0)
-                    #self.outputLayer.changeAttributeValue(feat[1], rank_field, 1.7976931348623158e+308)
-
-
-    def addOutputLayerToMap(self):
+    def fetchCriteria(self):
+        """ get suitability criteria from input form """
+        self.entered = self.readTable()
+        missing = self.dlg.missingPolicy()
+        self.criteria = {field_name: dict(spec, weight=int(spec["weight"]),
+                                          missing=missing)
+                         for field_name, spec in self.entered.items()}
+
+        self.aggregation = self.dlg.aggregationMethod.currentText()
+        self.topK = self.dlg.topK.value() or None
+        self.samples = self.dlg.sensitivitySamples.value()
+        self.spread = self.dlg.weightSpread.value() / 100
+        self.sampleTopK = self.dlg.sensitivityTopK.value()
+        self.fetchOptions()
+
+
+    def fetchOptions(self):
+        """ get the features to analyse and the output from input form """
+        self.inputLayer = self.dlg.layerInput.currentLayer()
+        self.joinOutput = self.dlg.joinOutput.isChecked()
+        self.selectedOnly = self.dlg.selectedOnly.isChecked()
+        self.destination = self.dlg.outputDestination()
+        self.flagExcluded = self.dlg.flagExcluded.isChecked()
+        self.extent, self.areaOfInterest = self.fetchArea(self.inputLayer)
+
+
+    def fetchValidCriteria(self):
+        """ fetchCriteria, reporting input that cannot be analysed
+
+        :returns: False if no analysis should start.
+        :rtype: bool
+        """
+        try:
+            self.fetchCriteria()
+        except ValueError:
+            iface.messageBar().pushMessage("Input error",
+                "Bounds and weights must be numbers",
+                level = Qgis.Critical,
+                duration = 10)
+            return False
+
+        if self.destination is not None and not self.destination[1]:
+            iface.messageBar().pushMessage("Input error",
+                "Choose a file to write the results to",
+                level = Qgis.Critical,
+                duration = 10)
+            return False
+
+        return self.validateWeights(self.entered)
+
+
+    def fetchArea(self, layer):
+        """ area of interest rectangle and polygon from the form, both in
+        the CRS of layer and None when not set """
+        extent = None
+        if self.dlg.canvasExtent.isChecked():
+            canvas = iface.mapCanvas()
+            transform = QgsCoordinateTransform(
+                canvas.mapSettings().destinationCrs(), layer.crs(),
+                QgsProject.instance())
+            extent = transform.transformBoundingBox(canvas.extent())
+
+        aoi = None
+        area_layer = self.dlg.aoiLayer.currentLayer()
+        if area_layer is not None:
+            request = QgsFeatureRequest().setNoAttributes()
+            aoi = QgsGeometry.unaryUnion([feat.geometry() for feat in
+                                          area_layer.getFeatures(request)])
+            aoi.transform(QgsCoordinateTransform(
+                area_layer.crs(), layer.crs(), QgsProject.instance()))
+            if aoi.isEmpty():
+                aoi = None
+
+        return extent, aoi
+
+
+    def filterKey(self):
+        """ key of the features the current form considers, see
+        filters.filter_key """
+        from .filters import filter_key
+
+        return filter_key(self.inputLayer, self.selectedOnly, self.extent,
+                          self.areaOfInterest)
+
+
+    def refreshProfiles(self):
+        """ list the saved criteria profiles in the dialog """
+        from .profiles import profile_names
+
+        name = self.dlg.profileName.currentText()
+        self.dlg.profileName.clear()
+        self.dlg.profileName.addItems(profile_names())
+        self.dlg.profileName.setCurrentText(name)
+
+
+    def saveCriteriaProfile(self):
+        """ save the criteria table as a named profile, with the cached
+        statistics of the current layer """
+        from .profiles import layer_fingerprint, save_profile
+
+        name = self.dlg.profileName.currentText().strip()
+        if not name:
+            iface.messageBar().pushMessage("Input error",
+                "Enter a name for the criteria profile",
+                level = Qgis.Critical,
+                duration = 10)
+            return
+
+        self.inputLayer = self.dlg.layerInput.currentLayer()
+        try:
+            criteria = self.readTable()
+        except ValueError:
+            iface.messageBar().pushMessage("Input error",
+                "Bounds and weights must be numbers",
+                level = Qgis.Critical,
+                duration = 10)
+            return
+        if not self.validateWeights(criteria):
+            return
+
+        layer = self.inputLayer
+        profile = {
+            "criteria": criteria,
+            "aggregation": self.dlg.aggregationMethod.currentText(),
+            "missing": self.dlg.missingPolicy(),
+            "fingerprint": layer_fingerprint(layer),
+            "stats": self.statistics.lookup(layer, list(criteria)),
+        }
+        try:
+            save_profile(name, profile, self.dlg.profileInProject.isChecked())
+        except (OSError, ValueError) as e:
+            iface.messageBar().pushMessage("Input error",
+                "Cannot save criteria profile \"{}\": {}".format(name, e),
+                level = Qgis.Critical,
+                duration = 10)
+            return
+        self.refreshProfiles()
+
+        iface.messageBar().pushMessage("Success",
+            "Criteria profile \"{}\" saved.".format(name),
+            level = Qgis.Success,
+            duration = 10)
+
+
+    def loadCriteriaProfile(self):
+        """ fill the criteria table from a named profile
+
+        The profile's statistics are reused when it was saved for the same
+        layer data, so neither the table nor the next run scans for them.
+        """
+        from .profiles import fingerprint_holds, load_profile
+
+        name = self.dlg.profileName.currentText().strip()
+        try:
+            profile = load_profile(name)
+        except (KeyError, OSError, ValueError):
+            iface.messageBar().pushMessage("Input error",
+                "Cannot load criteria profile \"{}\"".format(name),
+                level = Qgis.Critical,
+                duration = 10)
+            return
+
+        self.inputLayer = self.dlg.layerInput.currentLayer()
+        criteria = profile["criteria"]
+        if not self.validateWeights(criteria):
+            return
+
+        layer = self.inputLayer
+        if fingerprint_holds(layer, profile.get("fingerprint")):
+            self.statistics.restore(layer, profile.get("stats", {}))
+
+        self.dlg.fieldTable.clearContents()
+        self.dlg.fieldTable.setRowCount(len(criteria))
+        for row, (field_name, spec) in enumerate(criteria.items()):
+            self.setCriteriaRow(row, field_name, spec["lower"],
+                                spec["upper"], spec["weight"],
+                                spec["effect"], spec["method"])
+        self.dlg.aggregationMethod.setCurrentText(
+            profile.get("aggregation", "weighted_sum"))
+        self.dlg.setMissingPolicy(profile.get("missing", "exclude"))
+
+
+    def compareProfiles(self):
+        """ score the current layer for several saved criteria profiles
+        in one run, with a score and rank field per profile """
+        from .profiles import load_profile, profile_names, validate_criteria
+
+        names = self.dlg.chooseProfiles(profile_names())
+        if not names:
+            return
+
+        self.fetchOptions()
+        if self.destination is not None and not self.destination[1]:
+            iface.messageBar().pushMessage("Input error",
+                "Choose a file to write the results to",
+                level = Qgis.Critical,
+                duration = 10)
+            return
+
+        scenarios = {}
+        for name in names:
+            try:
+                profile = load_profile(name)
+            except (KeyError, OSError, ValueError):
+                iface.messageBar().pushMessage("Input error",
+                    "Cannot load criteria profile \"{}\"".format(name),
+                    level = Qgis.Critical,
+                    duration = 10)
+                return
+
+            problems = validate_criteria(profile["criteria"],
+                                         self.inputLayer.fields())
+            if problems:
+                iface.messageBar().pushMessage("Input error",
+                    "Profile \"{}\": {}".format(name, "; ".join(problems)),
+                    level = Qgis.Critical,
+                    duration = 10)
+                return
+
+            missing = profile.get("missing", "exclude")
+            criteria = {field_name: dict(spec, weight=int(spec["weight"]),
+                                         missing=missing)
+                        for field_name, spec in profile["criteria"].items()}
+            scenarios[name] = (criteria,
+                               profile.get("aggregation", "weighted_sum"))
+
+        self.dlg.done(0)
+        self.startTask(scenarios)
+
+
+    def startTask(self, scenarios=None):
+        """ queue the analysis as a background task
+
+        :param scenarios: Compare these scenarios instead of analysing the
+            criteria of the form, see ScenarioPipeline.
+        :type scenarios: dict
+        """
+        from .pipeline import (configured_workers, join_key_index,
+                               scenario_criteria)
+        from .spatial import spatial_criteria
+        from .task import ScenarioTask, SuitabilityTask
+
+        layer = self.inputLayer
+        generation = self.statistics.generation(layer)
+        criteria = (self.criteria if scenarios is None
+                    else scenario_criteria(scenarios))
+        stats = self.statistics.lookup(layer, list(criteria))
+        spatial = spatial_criteria(criteria, layer.crs(),
+                                   QgsProject.instance().transformContext(),
+                                   cache=self.spatialValues, layer=layer)
+
+        if self.joinOutput and join_key_index(layer) is None:
+            iface.messageBar().pushMessage("Info",
+                "Layer has no single-column primary key to join results on, "
+                "copying the features instead.",
+                level = Qgis.Info,
+                duration = 10)
+
+        if scenarios is None:
+            task = SuitabilityTask(layer, self.criteria, stats,
+                                   self.aggregation, self.topK,
+                                   self.joinOutput, self.createProfiler(),
+                                   configured_workers(), self.selectedOnly,
+                                   self.extent, self.areaOfInterest,
+                                   self.destination, self.flagExcluded,
+                                   self.samples, self.spread,
+                                   self.sampleTopK, spatial)
+        else:
+            task = ScenarioTask(layer, scenarios, stats, self.joinOutput,
+                                self.createProfiler(), configured_workers(),
+                                self.selectedOnly, self.extent,
+                                self.areaOfInterest, self.destination,
+                                self.flagExcluded, spatial)
+        # the layer may be removed while the task runs, keep only its id
+        task.taskCompleted.connect(partial(self.taskCompleted, task,
+                                           layer.id(), generation))
+        task.taskTerminated.connect(partial(self.taskTerminated, task))
+
+        # keep a reference, the task manager does not own the python object
+        self.tasks.append(task)
+        QgsApplication.taskManager().addTask(task)
+
+
+    def taskCompleted(self, task, layer_id, generation):
+        """ add the finished task's output to the map
+
+        Statistics and a joined view need the analysed layer, they are
+        skipped when it was removed while the task ran.
+        """
+        from .pipeline import joined_view
+
+        self.tasks.remove(task)
+        columns = task.pipeline.columns
+        layer = QgsProject.instance().mapLayer(layer_id)
+
+        # unfiltered columns hold every feature, reuse their statistics
+        if layer is not None and not task.pipeline.filtered:
+            self.statistics.store(layer_id, generation,
+                                  {name: values for name, values
+                                   in columns.items()
+                                   if name not in task.pipeline.spatial})
+
+        # spatial values hold for any subset of the features
+        for name, criterion in task.pipeline.spatial.items():
+            if (criterion.key is not None
+                    and self.spatialValues.isCurrent(criterion.key)):
+                self.spatialValues.store(criterion.key, task.pipeline.ids,
+                                         columns[name])
+
+        if task.pipeline.outputLayer is None:
+            # a file QGIS cannot read back, e.g. Parquet without GDAL support
+            self.lastRun = None
+        elif task.pipeline.join and layer is None:
+            # nothing left to join the result table onto
+            self.lastRun = None
+        elif task.pipeline.join:
+            # keep the result table in the project but out of the legend
+            table = task.pipeline.outputLayer
+            QgsProject.instance().addMapLayer(table, False)
+            view = joined_view(layer, table)
+            # the table has no legend entry, it goes with its view
+            view.willBeDeleted.connect(
+                partial(self.removeResultTable, table.id()))
+            self.addOutputLayerToMap(view)
+            self.lastRun = None
+        else:
+            output = task.pipeline.outputLayer
+            self.addOutputLayerToMap(output)
+            self.lastRun = (layer_id, generation, output.id(), task.pipeline)
+
+        self.logProfile(task.pipeline.profiler)
+
+        message = "Suitability analysis completed in {:.1f} s.".format(
+            task.pipeline.profiler.totalSeconds())
+        if task.pipeline.destination is not None:
+            message += " Results written to {}.".format(
+                task.pipeline.destination[1])
+        iface.messageBar().pushMessage("Success", message,
+            level = Qgis.Success,
+            duration = 10)
+
+
+    def removeResultTable(self, table_id):
+        """ remove the result table of a join-mode run whose view was
+        removed, once the project is done removing layers """
+        QTimer.singleShot(0, partial(QgsProject.instance().removeMapLayer,
+                                     table_id))
+
+
+    def taskTerminated(self, task):
+        """ report a cancelled or failed task """
+        self.tasks.remove(task)
+
+        if task.exception is None:
+            iface.messageBar().pushMessage("Cancelled",
+                "Suitability analysis was cancelled.",
+                level = Qgis.Info,
+                duration = 10)
+        else:
+            iface.messageBar().pushMessage("Error",
+                "Suitability analysis failed: {}".format(task.exception),
+                level = Qgis.Critical,
+                duration = 10)
+
+
+    def lastRunPipeline(self):
+        """ pipeline of the last run if it can be re-scored for the
+        current criteria, otherwise None """
+        if self.lastRun is None or self.joinOutput:
+            return None
+
+        layer_id, generation, output_id, pipeline = self.lastRun
+        layer = self.inputLayer
+        if (layer.id() != layer_id
+                or pipeline.destination != self.destination
+                or pipeline.flagExcluded != self.flagExcluded
+                or self.statistics.generation(layer) != generation
+                or QgsProject.instance().mapLayer(output_id) is None
+                or not all(self.spatialValues.isCurrent(criterion.key)
+                           for criterion in pipeline.spatial.values())
+                or not pipeline.canRescore(self.criteria, self.topK,
+                                           self.filterKey(), self.samples)):
+            return None
+        return pipeline
+
+
+    def rescoreLastRun(self):
+        """ update the last output layer in place when only weights,
+        effects, value functions or the aggregation changed
+
+        :returns: False when a full run is needed instead.
+        :rtype: bool
+        """
+        pipeline = self.lastRunPipeline()
+        if pipeline is None:
+            return False
+
+        pipeline.profiler = self.createProfiler()
+        updated = pipeline.rescore(self.criteria, self.aggregation)
+        pipeline.outputLayer.triggerRepaint()
+        self.logProfile(pipeline.profiler)
+
+        iface.messageBar().pushMessage("Success",
+            "Suitability scores updated in place, {} features changed.".format(updated),
+            level = Qgis.Success,
+            duration = 10)
+        return True
+
+
+    def togglePreview(self, checked):
+        """ preload the last run's criteria matrix for the weight sliders
+
+        While previewing, the score attribute of the memory output holds
+        the slider scores. Turning the preview off writes the scores of
+        the last run back and styles the output by them.
+        """
+        from .preview import WeightPreview
+
+        self.dlg.clearWeightSliders()
+        if self.preview is not None:
+            iface.mapCanvas().mapCanvasRefreshed.disconnect(
+                self.previewRendered)
+            self.preview.finish()
+        self.preview = None
+        self.previewStart = None
+        if not checked:
+            return
+
+        try:
+            self.fetchCriteria()
+        except ValueError:
+            iface.messageBar().pushMessage("Input error",
+                "Bounds and weights must be numbers",
+                level = Qgis.Critical,
+                duration = 10)
+            self.dlg.previewBox.setChecked(False)
+            return
+
+        pipeline = self.lastRunPipeline()
+        if (pipeline is None or self.aggregation != 'weighted_sum'
+                or pipeline.outputLayer.providerType() != 'memory'):
+            iface.messageBar().pushMessage("Info",
+                "Run the analysis once with weighted_sum aggregation into a "
+                "temporary layer, on the same fields and bounds, to enable "
+                "the live preview.",
+                level = Qgis.Info,
+                duration = 10)
+            self.dlg.previewBox.setChecked(False)
+            return
+
+        # normalized in memory for the effects and value functions of the
+        # form, OK re-scores the output for good
+        self.preview = WeightPreview(pipeline, self.criteria)
+        self.preview.preload()
+        iface.mapCanvas().mapCanvasRefreshed.connect(self.previewRendered)
+        self.dlg.setWeightSliders({field: spec['weight']
+                                   for field, spec in self.criteria.items()})
+
+
+    def updatePreview(self, weights):
+        """ restyle the output layer for the slider weights """
+        if self.preview is None:
+            return
+
+        self.previewStart = time.perf_counter()
+        self.preview.preview(weights)
+
+
+    def previewRendered(self):
+        """ log a weight preview that was not on the map within
+        PREVIEW_BUDGET, scores, classes and redraw included """
+        if self.previewStart is None:
+            return
+
+        elapsed = time.perf_counter() - self.previewStart
+        self.previewStart = None
+        if elapsed > PREVIEW_BUDGET:
+            QgsMessageLog.logMessage(
+                "Weight preview took {:.0f} ms".format(elapsed * 1000),
+                "Suitability Analysis", Qgis.Warning)
+
+
+    def createProfiler(self):
+        """ stage profiler configured from the plugin settings
+
+        SuitabilityAnalysis/traceMemory (default false) records peak
+        traced memory, SuitabilityAnalysis/profileScoring (default false)
+        runs the scoring stage under cProfile.
+        """
+        settings = QSettings()
+        trace_memory = settings.value('SuitabilityAnalysis/traceMemory',
+                                      False, type=bool)
+        profile_stages = []
+        if settings.value('SuitabilityAnalysis/profileScoring',
+                          False, type=bool):
+            profile_stages.append('calculations')
+        return StageProfiler(trace_memory, profile_stages)
+
+
+    def logProfile(self, profiler):
+        """ write stage timings to the message log and, when the
+        SuitabilityAnalysis/profileFile setting names one, a JSON file """
+        QgsMessageLog.logMessage(profiler.report(),
+            "Suitability Analysis", Qgis.Info)
+
+        path = QSettings().value('SuitabilityAnalysis/profileFile', '')
+        if path:
+            try:
+                profiler.writeJson(path)
+            except OSError as e:
+                QgsMessageLog.logMessage(
+                    "Could not write profile file: {}".format(e),
+                    "Suitability Analysis", Qgis.Warning)
+
+
+    def addOutputLayerToMap(self, layer):
         """ add memory layer to map """
-        suitability_output = self.outputLayer
-        QgsProject.instance().addMapLayer(suitability_output)
+        QgsProject.instance().addMapLayer(layer)
 
 
     def run(self):
         """ run method that performs all the real work """   
 
-        startTime = time.time()
-
         # Create the dialog with elements (after translation) and keep reference
         # Only create GUI ONCE in callback, so that it will only load when the plugin is started
         if self.first_start == True:
             self.first_start = False
+            # Import the code for the dialog
+            from .suitability_analysis_dialog import SuitabilityAnalysisDialog
             self.dlg = SuitabilityAnalysisDialog()
+            self.dlg.previewBox.toggled.connect(self.togglePreview)
+            self.dlg.weightsChanged.connect(self.updatePreview)
+            self.dlg.saveProfile.clicked.connect(self.saveCriteriaProfile)
+            self.dlg.loadProfile.clicked.connect(self.loadCriteriaProfile)
+            self.dlg.compareProfiles.clicked.connect(self.compareProfiles)
 
-        # show the dialog
-        self.dlg.show()
+            # update fields when active layer changed
+            self.dlg.layerInput.layerChanged.connect(self.updateFields)
 
-        # populate the initial available fields
-        self.dlg.fieldSelector.addItems([str(x.name()) for x in 
-            self.dlg.layerInput.currentLayer().fields() if x.isNumeric()])
+            self.dlg.fieldSelector.setSelectionMode(QAbstractItemView.MultiSelection)
 
-        # update fields when active layer changed
-        self.dlg.layerInput.layerChanged.connect(self.updateFields)
+            # populate table with selected fields
+            self.dlg.addFields.clicked.connect(self.populateTable)
 
-        self.dlg.fieldSelector.setSelectionMode(QAbstractItemView.MultiSelection)
-        
-        # populate table with selected fields
-        self.dlg.addFields.clicked.connect(self.populateTable)
+            # reset form
+            self.dlg.addFields_2.clicked.connect(self.updateFields)
+
+        # show the dialog
+        self.dlg.show()
+        self.refreshProfiles()
 
-        # reset form
-        self.dlg.addFields_2.clicked.connect(self.updateFields)
+        # populate the available fields, unless they are still current
+        self.refreshFields()
 
         # Run the dialog event loop
         result = self.dlg.exec_()
         # See if OK was pressed
-        if result:
-
-            #if self.validateWeights() == True:
+        if result and self.fetchValidCriteria():
+            if not self.rescoreLastRun():
+                self.startTask()
 
-            self.fetchCriteria()
-            self.createOutputLayer()
-            self.pandify()
-            self.calculations()
-            self.updateSHP()
-            self.addOutputLayerToMap()
-
-            #executionTime = str(round((time.time() - startTime), 2))
-
-            iface.messageBar().pushMessage("Success",
-                "Suitability analysis completed.",
-                #"Suitability analysis completed in " + executionTime + " s.",
-                level = Qgis.Success,
-                duration = 10)
+        # style the output by the written scores again
+        if self.preview is not None:
+            self.dlg.previewBox.setChecked(False)
@@ -14,13 +14,36 @@ import os
 
 from qgis.PyQt import uic
 from qgis.PyQt import QtWidgets
+from qgis.PyQt.QtCore import Qt, QTimer, pyqtSignal
+from qgis.core import QgsMapLayerProxyModel
+from qgis.gui import QgsFileWidget
+
+from .export import FORMATS
 
 # This loads your .ui file so that PyQt can populate your plugin with the elements from Qt Designer
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
     os.path.dirname(__file__), 'suitability_analysis_dialog.ui'))
 
+# milliseconds a weight slider must rest before the preview updates
+PREVIEW_DELAY = 40
+
+# output format entry writing to a memory layer
+TEMPORARY_OUTPUT = 'Temporary layer'
+
+# labels of the scoring.MISSING_POLICIES
+MISSING_LABELS = [
+    ('Exclude NULL values', 'exclude'),
+    ('Impute NULL as mean', 'mean'),
+    ('Impute NULL as median', 'median'),
+    ('Score NULL as worst', 'worst'),
+]
+
 
 class SuitabilityAnalysisDialog(QtWidgets.QDialog, FORM_CLASS):
+
+    # emitted with {field: weight} once the weight sliders come to rest
+    weightsChanged = pyqtSignal(dict)
+
     def __init__(self, parent=None):
         """Constructor."""
         super(SuitabilityAnalysisDialog, self).__init__(parent)
@@ -30,3 +53,128 @@ class SuitabilityAnalysisDialog(QtWidgets.QDialog, FORM_CLASS):
         # http://qt-project.org/doc/qt-4.8/designer-using-a-ui-file.html
         # #widgets-and-dialogs-with-auto-connect
         self.setupUi(self)
+
+        # optional polygon layer limiting the analysed features
+        self.aoiLayer.setFilters(QgsMapLayerProxyModel.PolygonLayer)
+        self.aoiLayer.setAllowEmptyLayer(True)
+        self.aoiLayer.setLayer(None)
+
+        self.outputFormat.addItems([TEMPORARY_OUTPUT] + list(FORMATS))
+        self.outputPath.setStorageMode(QgsFileWidget.SaveFile)
+        self.outputFormat.currentTextChanged.connect(self.setOutputFormat)
+        self.setOutputFormat(TEMPORARY_OUTPUT)
+
+        for label, policy in MISSING_LABELS:
+            self.missingValues.addItem(label, policy)
+
+        self.sliders = {}
+        self.sliderLayout = QtWidgets.QFormLayout(self.previewBox)
+
+        # debounce slider moves into one preview update
+        self.previewTimer = QTimer(self)
+        self.previewTimer.setSingleShot(True)
+        self.previewTimer.setInterval(PREVIEW_DELAY)
+        self.previewTimer.timeout.connect(self.emitWeights)
+
+
+    def setOutputFormat(self, file_format):
+        """ match the output file chooser to the selected format """
+        self.outputPath.setEnabled(file_format in FORMATS)
+        if file_format in FORMATS:
+            extension = FORMATS[file_format][1]
+            self.outputPath.setFilter('{0} (*.{1} *.{2})'.format(
+                file_format, extension, extension.upper()))
+
+
+    def outputDestination(self):
+        """ selected (format, path) pair, None for a temporary layer """
+        file_format = self.outputFormat.currentText()
+        if file_format not in FORMATS:
+            return None
+        return (file_format, self.outputPath.filePath())
+
+
+    def missingPolicy(self):
+        """ selected missing value policy, see scoring.MISSING_POLICIES """
+        return self.missingValues.currentData()
+
+
+    def setMissingPolicy(self, policy):
+        """ select a missing value policy """
+        self.missingValues.setCurrentIndex(
+            max(self.missingValues.findData(policy), 0))
+
+
+    def chooseProfiles(self, names):
+        """ let the user pick the criteria profiles to compare
+
+        :param names: Names of the saved profiles.
+        :type names: list
+
+        :returns: Chosen names in list order, empty if cancelled.
+        :rtype: list
+        """
+        chooser = QtWidgets.QDialog(self)
+        chooser.setWindowTitle('Compare criteria profiles')
+        layout = QtWidgets.QVBoxLayout(chooser)
+
+        profiles = QtWidgets.QListWidget()
+        profiles.setSelectionMode(QtWidgets.QAbstractItemView.MultiSelection)
+        profiles.addItems(names)
+        layout.addWidget(profiles)
+
+        buttons = QtWidgets.QDialogButtonBox(
+            QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        buttons.accepted.connect(chooser.accept)
+        buttons.rejected.connect(chooser.reject)
+        layout.addWidget(buttons)
+
+        if not chooser.exec_():
+            return []
+        return [profiles.item(row).text() for row in range(profiles.count())
+                if profiles.item(row).isSelected()]
+
+
+    def setWeightSliders(self, weights):
+        """ show one 0-100 slider per criterion
+
+        :param weights: Mapping of criteria field to its current weight.
+        :type weights: dict
+        """
+        self.clearWeightSliders()
+        for field, weight in weights.items():
+            slider = QtWidgets.QSlider(Qt.Horizontal)
+            slider.setRange(0, 100)
+            slider.setValue(int(weight))
+            slider.valueChanged.connect(self.previewTimer.start)
+            self.sliderLayout.addRow(field, slider)
+            self.sliders[field] = slider
+
+
+    def clearWeightSliders(self):
+        """ remove all weight sliders """
+        self.previewTimer.stop()
+        while self.sliderLayout.rowCount():
+            self.sliderLayout.removeRow(0)
+        self.sliders = {}
+
+
+    def emitWeights(self):
+        """ copy slider weights into the table and announce them
+
+        Every slider runs from 0 to 100 on its own, so their values are
+        rescaled to sum to 100 as the criteria table requires.
+        """
+        weights = {field: slider.value()
+                   for field, slider in self.sliders.items()}
+        total = sum(weights.values())
+        if total > 0:
+            weights = {field: round(100 * weight / total, 2)
+                       for field, weight in weights.items()}
+
+        for row in range(self.fieldTable.rowCount()):
+            field = self.fieldTable.item(row, 0).text()
+            if field in weights:
+                self.fieldTable.item(row, 3).setText(str(weights[field]))
+
+        self.weightsChanged.emit(weights)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ SuitabilityRanker
+ A QGIS plugin
+ Vector-based site suitability analysis
+
+        copyright            : (C) 2022 by John Allanach
+        email                : johnallanach@protonmail.com
+ ***************************************************************************/
+"""
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import QgsFeedback, QgsTask
+
+from .pipeline import ScenarioPipeline, SuitabilityPipeline
+
+
+class PipelineTask(QgsTask):
+    """ runs a pipeline on the QGIS task manager
+
+    The output layer is moved back to the main thread before the task
+    finishes, so taskCompleted handlers can add it to the project.
+    """
+
+    def __init__(self, description, pipeline):
+        """Constructor, must be called on the main thread.
+
+        :param description: Task description shown in the task manager.
+        :type description: str
+
+        :param pipeline: Pipeline to run, see SuitabilityPipeline.
+        :type pipeline: SuitabilityPipeline
+        """
+        super().__init__(description, QgsTask.CanCancel)
+        self.pipeline = pipeline
+        self.feedback = QgsFeedback()
+        self.feedback.progressChanged.connect(self.setProgress)
+        self.exception = None
+
+
+    def run(self):
+        """ run the pipeline on a worker thread """
+        try:
+            completed = self.pipeline.run(self.feedback)
+        except Exception as e:
+            self.exception = e
+            return False
+
+        if not completed:
+            return False
+
+        # files QGIS cannot read back have no output layer
+        if self.pipeline.outputLayer is not None:
+            self.pipeline.outputLayer.moveToThread(
+                QCoreApplication.instance().thread())
+        return True
+
+
+    def cancel(self):
+        """ stop the feature loops at their next cancellation check """
+        self.feedback.cancel()
+        super().cancel()
+
+
+class SuitabilityTask(PipelineTask):
+    """ runs a SuitabilityPipeline on the QGIS task manager """
+
+    def __init__(self, layer, criteria, stats=None,
+                 aggregation='weighted_sum', top_k=None, join=False,
+                 profiler=None, workers=1, selected_only=False,
+                 extent=None, aoi=None, destination=None,
+                 flag_excluded=False, samples=0, spread=0.2,
+                 sample_top_k=10, spatial=None):
+        """Constructor, must be called on the main thread.
+
+        :param layer: Layer to analyse.
+        :type layer: QgsVectorLayer
+
+        :param criteria: Criteria spec as built by fetchCriteria.
+        :type criteria: dict
+
+        :param stats: Cached (min, max) of the criteria fields.
+        :type stats: dict
+
+        :param aggregation: Name of a scoring.AGGREGATIONS entry.
+        :type aggregation: str
+
+        :param top_k: Only keep the k best features.
+        :type top_k: int
+
+        :param join: Produce a result table to join onto the layer.
+        :type join: bool
+
+        :param profiler: Records timing and memory of every stage.
+        :type profiler: StageProfiler
+
+        :param workers: Threads the pipeline may use.
+        :type workers: int
+
+        :param selected_only: Only analyse the selected features.
+        :type selected_only: bool
+
+        :param extent: Area of interest rectangle in the layer CRS.
+        :type extent: QgsRectangle
+
+        :param aoi: Area of interest polygon in the layer CRS.
+        :type aoi: QgsGeometry
+
+        :param destination: Output (format, path), see export.FORMATS.
+        :type destination: tuple
+
+        :param flag_excluded: Keep unscored features with a status.
+        :type flag_excluded: bool
+
+        :param samples: Weight samples of a sensitivity analysis.
+        :type samples: int
+
+        :param spread: Relative spread of the sampled weights.
+        :type spread: float
+
+        :param sample_top_k: K of the share of samples in the top K.
+        :type sample_top_k: int
+
+        :param spatial: Spatial criteria, see spatial.spatial_criteria.
+        :type spatial: dict
+        """
+        super().__init__(
+            'Suitability analysis of {}'.format(layer.name()),
+            SuitabilityPipeline(layer, criteria, stats, aggregation, top_k,
+                                join, profiler, workers, selected_only,
+                                extent, aoi, destination, flag_excluded,
+                                samples, spread, sample_top_k, spatial))
+
+
+class ScenarioTask(PipelineTask):
+    """ runs a ScenarioPipeline on the QGIS task manager """
+
+    def __init__(self, layer, scenarios, stats=None, join=False,
+                 profiler=None, workers=1, selected_only=False,
+                 extent=None, aoi=None, destination=None,
+                 flag_excluded=False, spatial=None):
+        """Constructor, must be called on the main thread.
+
+        :param scenarios: Mapping of scenario name to (criteria,
+            aggregation), see ScenarioPipeline.
+        :type scenarios: dict
+
+        See SuitabilityTask for the other parameters.
+        """
+        super().__init__(
+            'Scenario comparison of {}'.format(layer.name()),
+            ScenarioPipeline(layer, scenarios, stats, join, profiler,
+                             workers, selected_only, extent, aoi,
+                             destination, flag_excluded, spatial))